@@ -24,20 +24,35 @@ import logging
 import logging.handlers
 import threading
 import uuid
+import atexit
+import socket
+import hmac
+import random
 import re
+import json
 import time
 import sqlite3
+import queue
+import heapq
+import copy
 import shutil
 import subprocess
 import gc
 import glob
 import weakref
+import functools
+import importlib
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Import necessário para o retry de timeout
 from telegram.error import TimedOut
 
 from collections import OrderedDict, deque
 from contextlib import contextmanager
+from dataclasses import dataclass
 from urllib.parse import parse_qs, quote, unquote, urlparse
 from datetime import datetime, timedelta
 
@@ -45,34 +60,74 @@ import yt_dlp
 
 try:
     import requests
-    from bs4 import BeautifulSoup
     REQUESTS_AVAILABLE = True
 except ImportError:
     REQUESTS_AVAILABLE = False
 
+# SDKs pesados (Mercado Pago, Groq): só verifica se estão instalados; o import
+# real acontece no primeiro uso (cold start mais rápido e menos RSS)
+MERCADOPAGO_AVAILABLE = importlib.util.find_spec("mercadopago") is not None
+GROQ_AVAILABLE = importlib.util.find_spec("groq") is not None
+
+class LazyClient:
+    """Proxy que importa o SDK e cria o cliente apenas no primeiro acesso"""
+    __slots__ = ("_factory", "_obj", "_lock")
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        obj = self._obj
+        if obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+                obj = self._obj
+        return getattr(obj, name)
+
 try:
-    from PIL import Image
-    PIL_AVAILABLE = True
+    import psutil
+    PSUTIL_AVAILABLE = True
 except ImportError:
-    PIL_AVAILABLE = False
-    
+    PSUTIL_AVAILABLE = False
+
+# Servidor ASGI (uvicorn) com fallback para o servidor embutido do Flask.
+# a2wsgi roda o Flask num pool de threads próprio (o WsgiToAsgi do asgiref
+# serializaria todas as requisições numa única thread)
 try:
-    import mercadopago
-    MERCADOPAGO_AVAILABLE = True
+    import uvicorn
+    from a2wsgi import WSGIMiddleware
+    ASGI_AVAILABLE = True
 except ImportError:
-    MERCADOPAGO_AVAILABLE = False
+    ASGI_AVAILABLE = False
 
+# Event loop libuv (uvloop) quando disponível
 try:
-    from groq import Groq
-    GROQ_AVAILABLE = True
+    import uvloop
+    UVLOOP_AVAILABLE = True
 except ImportError:
-    GROQ_AVAILABLE = False
+    UVLOOP_AVAILABLE = False
 
+# HTTP/2 para a API do Telegram (httpx precisa do pacote h2)
 try:
-    import psutil
-    PSUTIL_AVAILABLE = True
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
 except ImportError:
-    PSUTIL_AVAILABLE = False
+    HTTP2_AVAILABLE = False
+
+# JSON rápido (orjson) com fallback para a stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps  # Retorna bytes
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    json_loads = json.loads
+    json_dumps = lambda obj: json.dumps(obj).encode("utf-8")
+    ORJSON_AVAILABLE = False
 
 # 🔧 FIX 413: Compressão de vídeos grandes
 try:
@@ -91,6 +146,20 @@ from datetime import datetime
 KEEPALIVE_ENABLED = os.getenv("KEEPALIVE_ENABLED", "true").lower() == "true"
 KEEPALIVE_INTERVAL = int(os.getenv("KEEPALIVE_INTERVAL", "600"))  # 10 minutos (otimizado de 300s - reduz CPU em 50%)
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL do seu bot no Render
+PORT = int(os.getenv("PORT", "10000"))  # Porta do servidor HTTP (lida uma vez)
+BIND_HOST = "0.0.0.0"
+# Conexões simultâneas que o Telegram abre contra o webhook; o pool HTTPX de
+# saída (BOT_POOL) deve ser >= a esse valor para evitar PoolTimeout
+WEBHOOK_MAX_CONN = int(os.getenv("WEBHOOK_MAX_CONN", "100"))
+BOT_POOL_SIZE = int(os.getenv("BOT_POOL", str(WEBHOOK_MAX_CONN)))
+# Threads que executam as views do Flask sob o uvicorn (webhook, PIX, health)
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+# Segredo enviado pelo Telegram no header X-Telegram-Bot-Api-Secret-Token
+# (gerar com secrets.token_urlsafe(32) no deploy); vazio = sem verificação
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+# Descarta updates acumulados ao reiniciar; use DROP_PENDING_ON_RESTART=0 só
+# quando quiser reprocessar a fila (ex: janela de migração)
+DROP_PENDING = os.getenv("DROP_PENDING_ON_RESTART", "1") == "1"
 LAST_ACTIVITY = {"telegram": time.time(), "flask": time.time()}
 INACTIVITY_THRESHOLD = 1800  # 30 minutos sem atividade = aviso
 
@@ -143,13 +212,17 @@ class BotHealthMonitor:
         self.is_healthy = True
         
     def record_activity(self, source: str = "telegram"):
-        """Registra atividade do bot - THREAD SAFE"""
-        with self.lock:
-            LAST_ACTIVITY[source] = time.time()
-            if source == "telegram":
-                self.last_telegram_update = time.time()
-                self.webhook_errors = 0
-                self.consecutive_errors = 0
+        """Registra atividade do bot - sem lock no caminho comum"""
+        # Atribuições simples são atômicas sob o GIL; leitores só querem o último valor
+        now = time.time()
+        LAST_ACTIVITY[source] = now
+        if source == "telegram":
+            self.last_telegram_update = now
+            # Só sincroniza quando há contadores de erro para zerar
+            if self.webhook_errors or self.consecutive_errors:
+                with self.lock:
+                    self.webhook_errors = 0
+                    self.consecutive_errors = 0
     
     def check_health(self) -> dict:
         """Verifica saúde do bot - THREAD SAFE"""
@@ -209,8 +282,10 @@ health_monitor = BotHealthMonitor()
 # ════════════════════════════════════════════════════════════════
 # 📝 CONFIGURAR LOGGING (UMA ÚNICA VEZ - ANTES DE USAR LOG)
 # ════════════════════════════════════════════════════════════════
+# Nível configurável (LOGLEVEL=WARNING silencia o INFO do caminho quente)
+LOG_LEVEL = os.getenv("LOGLEVEL", "INFO").upper()
 LOG = logging.getLogger("ytbot")
-LOG.setLevel(logging.INFO)
+LOG.setLevel(LOG_LEVEL)
 
 # REMOVER TODOS OS HANDLERS ANTERIORES (se houver)
 if LOG.hasHandlers():
@@ -219,7 +294,7 @@ if LOG.hasHandlers():
 
 # Handler para console (para ver nos logs do Render)
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+console_handler.setLevel(LOG_LEVEL)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 LOG.addHandler(console_handler)
 
@@ -232,7 +307,7 @@ if os.path.exists('/tmp'):
             backupCount=2,
             encoding='utf-8'
         )
-        file_handler.setLevel(logging.INFO)
+        file_handler.setLevel(LOG_LEVEL)
         file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
         LOG.addHandler(file_handler)
     except Exception:
@@ -256,8 +331,15 @@ LAST_MEMORY_CLEANUP = time.time()
 MEMORY_CLEANUP_INTERVAL = 300  # 5 minutos
 MAX_MEMORY_USAGE_MB = 500  # Limpa agressivamente se passar de 500MB
 
-# Dicionário para rastrear downloads ativos
-ACTIVE_DOWNLOADS = {}
+@dataclass(slots=True)
+class ActiveDownload:
+    """Registro compacto de um download em andamento (sem __dict__ por entrada)"""
+    user_id: int
+    started_at: float
+    tmpdir: str | None = None  # Preenchido quando o download sai da fila
+
+# Dicionário para rastrear downloads ativos (token -> ActiveDownload)
+ACTIVE_DOWNLOADS: dict[str, ActiveDownload] = {}
 
 # ════════════════════════════════════════════════════════════════
 # 📦 LIMITED CACHE PARA USER_LAST_DOWNLOAD
@@ -292,6 +374,10 @@ class LimitedCache:
     def __contains__(self, key):
         return key in self.cache
 
+    def pop(self, key, default=None):
+        """Remove e retorna valor do cache"""
+        return self.cache.pop(key, default)
+
     def get_size(self):
         return len(self.cache)
 
@@ -303,6 +389,17 @@ class LimitedCache:
 USER_LAST_DOWNLOAD = LimitedCache(max_size=50)  # Reduzido de 300 para 50 - economiza ~50MB
 LOG.info("📦 LimitedCache para USER_LAST_DOWNLOAD inicializado (max_size=50, não cresce infinito)")
 
+async def _wait_webhook_cleared(deadline: float = 2.0):
+    """Espera o Telegram refletir o delete_webhook (no máximo `deadline` segundos)"""
+    end = time.monotonic() + deadline
+    delay = 0.1
+    while time.monotonic() < end:
+        info = await application.bot.get_webhook_info()
+        if not info.url:
+            return
+        await asyncio.sleep(min(delay, max(0.0, end - time.monotonic())))
+        delay *= 2
+
 async def reconnect_webhook():
     """Reconecta o webhook do Telegram quando trava"""
     if not WEBHOOK_URL:
@@ -310,20 +407,14 @@ async def reconnect_webhook():
         return False
     
     try:
-        webhook_url = f"{WEBHOOK_URL}/{TOKEN}"
         LOG.info("🔧 Reconectando webhook...")
         
         # Remove webhook antigo
         await application.bot.delete_webhook(drop_pending_updates=True)
-        await asyncio.sleep(2)
+        await _wait_webhook_cleared()
         
         # Configura novo webhook
-        result = await application.bot.set_webhook(
-            url=webhook_url,
-            drop_pending_updates=False,
-            max_connections=100,
-            allowed_updates=["message", "callback_query"]
-        )
+        result = await application.bot.set_webhook(drop_pending_updates=False, **SET_WEBHOOK_ARGS)
         
         if result:
             LOG.info("✅ Webhook reconectado com sucesso!")
@@ -341,16 +432,61 @@ async def reconnect_webhook():
 # 💾 FUNÇÕES DE MONITORAMENTO E LIMPEZA DE MEMÓRIA
 # ════════════════════════════════════════════════════════════════
 
-def get_memory_usage_mb():
-    """Retorna uso de memória atual em MB"""
+# Amostra de sistema atualizada em background: leituras viram acesso a dict
+SYS_SAMPLE_INTERVAL = 2
+SYS_SNAPSHOT = {"mem_mb": 0.0, "children_mb": 0.0, "ts": 0.0}
+_PROCESS = psutil.Process(os.getpid()) if PSUTIL_AVAILABLE else None
+# Filhos (workers do pool do yt-dlp) são lidos via smaps (~2ms por leitura):
+# amostrados só a cada CHILD_SAMPLE_EVERY ciclos do sampler
+CHILD_SAMPLE_EVERY = 5
+
+def _sample_memory_mb():
+    """Lê o RSS do processo em MB (acessa /proc)"""
     try:
-        if PSUTIL_AVAILABLE:
-            process = psutil.Process(os.getpid())
-            return process.memory_info().rss / 1024 / 1024  # Converte para MB
+        if _PROCESS is not None:
+            return _PROCESS.memory_info().rss / 1024 / 1024  # Converte para MB
         return 0
     except:
         return 0
 
+def _sample_children_mb():
+    """Memória própria (USS) dos processos filhos em MB.
+
+    Os workers são fork do processo principal: as páginas herdadas já
+    entram no RSS do pai, então de cada filho conta só o que é exclusivo dele.
+    """
+    if _PROCESS is None:
+        return 0
+    total = 0
+    try:
+        children = _PROCESS.children()
+    except psutil.Error:
+        return 0
+    for child in children:
+        try:
+            total += child.memory_full_info().uss
+        except psutil.Error:
+            pass  # Worker encerrado durante a leitura
+    return total / 1024 / 1024
+
+async def system_sampler_routine():
+    """Atualiza SYS_SNAPSHOT a cada SYS_SAMPLE_INTERVAL segundos"""
+    tick = 0
+    while True:
+        if tick % CHILD_SAMPLE_EVERY == 0:
+            SYS_SNAPSHOT["children_mb"] = _sample_children_mb()
+        tick += 1
+        # Leitura do RSS é um único read() em /proc: barata o bastante para o loop
+        SYS_SNAPSHOT.update(mem_mb=_sample_memory_mb() + SYS_SNAPSHOT["children_mb"], ts=time.time())
+        await asyncio.sleep(SYS_SAMPLE_INTERVAL)
+
+def get_memory_usage_mb():
+    """Retorna uso de memória atual em MB, incluindo os workers do yt-dlp (da amostra em background)"""
+    if time.time() - SYS_SNAPSHOT["ts"] > SYS_SAMPLE_INTERVAL * 5:
+        # Sampler parado ou ainda não iniciado: lê direto
+        return _sample_memory_mb() + _sample_children_mb()
+    return SYS_SNAPSHOT["mem_mb"]
+
 def cleanup_memory():
     """Limpeza agressiva de memória"""
     global LAST_MEMORY_CLEANUP
@@ -360,49 +496,58 @@ def cleanup_memory():
         return  # Não limpa ainda, intervalo mínimo
     
     try:
-        # Força garbage collection
-        collected = gc.collect()
+        # Gerações 0-1 bastam no caso comum; coleta completa só com memória alta
+        collected = gc.collect(1)
         
         current_memory = get_memory_usage_mb()
         if current_memory > 0:
-            LOG.debug(f"💾 Limpeza de memória: {current_memory:.1f}MB (coletadas {collected} objetos)")
+            LOG.debug("💾 Limpeza de memória: %.1fMB (coletadas %s objetos)", current_memory, collected)
         
             # Se passou do limite, limpa mais agressivamente
             if current_memory > MAX_MEMORY_USAGE_MB:
-                LOG.warning(f"⚠️ Memória alta ({current_memory:.1f}MB)! Limpeza agressiva...")
+                LOG.warning("⚠️ Memória alta (%.1fMB)! Limpeza agressiva...", current_memory)
                 gc.collect()
                 gc.collect()  # Dupla passada
                 
-                new_memory = get_memory_usage_mb()
-                LOG.info(f"✅ Memória reduzida: {current_memory:.1f}MB → {new_memory:.1f}MB")
+                new_memory = _sample_memory_mb()
+                LOG.info("✅ Memória reduzida: %.1fMB → %.1fMB", current_memory, new_memory)
         else:
-            LOG.debug(f"💾 GC executado: {collected} objetos coletados")
+            LOG.debug("💾 GC executado: %s objetos coletados", collected)
         
         LAST_MEMORY_CLEANUP = current_time
         
     except Exception as e:
-        LOG.error(f"❌ Erro na limpeza de memória: {e}")
+        LOG.error("❌ Erro na limpeza de memória: %s", e)
+
+# Referências fortes às tarefas de manutenção (evita coleta pelo GC)
+BACKGROUND_TASKS = set()
+# Coletas do GC rodam fora do APP_LOOP, uma por vez
+GC_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gc")
 
 async def memory_cleanup_routine():
     """Rotina periódica de limpeza de memória (executa a cada 5 minutos)"""
     while True:
         try:
             await asyncio.sleep(MEMORY_CLEANUP_INTERVAL)
-            cleanup_memory()
+            await asyncio.get_running_loop().run_in_executor(GC_EXEC, cleanup_memory)
         except Exception as e:
-            LOG.error(f"❌ Erro na rotina de limpeza: {e}")
+            LOG.error("❌ Erro na rotina de limpeza: %s", e)
             await asyncio.sleep(60)  # Tenta de novo em 1 minuto
 
-def reconnect_webhook_sync():
-    """Versão síncrona para chamar de threads"""
-    try:
-        future = asyncio.run_coroutine_threadsafe(reconnect_webhook(), APP_LOOP)
-        return future.result(timeout=15)
-    except Exception as e:
-        LOG.error("❌ Erro na reconexão síncrona: %s", e)
-        return False
-
-def keepalive_routine():
+# Sessão keep-alive para o self-ping: reaproveita a conexão TLS com o Render
+KEEPALIVE_SESSION = None
+if REQUESTS_AVAILABLE:
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    KEEPALIVE_SESSION = requests.Session()
+    KEEPALIVE_SESSION.mount("https://", HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=4,
+        max_retries=Retry(total=2, backoff_factor=0.5)
+    ))
+KEEPALIVE_URL = f"{WEBHOOK_URL}/health" if WEBHOOK_URL else None
+
+async def keepalive_routine():
     """
     Rotina de keepalive que:
     1. Faz ping no próprio bot a cada 5 minutos
@@ -415,7 +560,7 @@ def keepalive_routine():
     
     while True:
         try:
-            time.sleep(KEEPALIVE_INTERVAL)
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
             
             # 1. Verifica saúde
             health = health_monitor.check_health()
@@ -426,7 +571,7 @@ def keepalive_routine():
                 if WEBHOOK_URL:
                     try:
                         LOG.info("🔧 Tentando reconectar webhook...")
-                        if reconnect_webhook_sync():
+                        if await reconnect_webhook():
                             LOG.info("✅ Webhook reconectado com sucesso!")
                         else:
                             LOG.error("❌ Falha ao reconectar webhook")
@@ -434,10 +579,11 @@ def keepalive_routine():
                         LOG.error("❌ Erro na reconexão: %s", e)
             
             # 2. Self-ping (mantém Render acordado)
-            if WEBHOOK_URL:
+            if KEEPALIVE_URL and KEEPALIVE_SESSION is not None:
                 try:
-                    response = requests.get(
-                        f"{WEBHOOK_URL}/health",
+                    response = await asyncio.to_thread(
+                        KEEPALIVE_SESSION.get,
+                        KEEPALIVE_URL,
                         timeout=10
                     )
                     if response.status_code == 200:
@@ -453,14 +599,14 @@ def keepalive_routine():
         except Exception as e:
             LOG.exception("❌ Erro na rotina de keepalive: %s", e)
 
-def webhook_watchdog():
+async def webhook_watchdog():
     """
     Watchdog que monitora o webhook e força reconexão se necessário
     OTIMIZADO: Verifica a cada 3 minutos (reduz CPU em 66%)
     """
     while True:
         try:
-            time.sleep(180)  # 3 minutos (otimizado de 60s)
+            await asyncio.sleep(180)  # 3 minutos (otimizado de 60s)
             
             now = time.time()
             last_telegram = LAST_ACTIVITY["telegram"]
@@ -472,18 +618,17 @@ def webhook_watchdog():
                 
                 # Verifica se webhook está configurado
                 try:
-                    webhook_info = asyncio.run_coroutine_threadsafe(
+                    webhook_info = await asyncio.wait_for(
                         application.bot.get_webhook_info(),
-                        APP_LOOP
-                    ).result(timeout=10)
+                        timeout=10
+                    )
                     
                     LOG.info("📊 Webhook Info: URL=%s, Pending=%d", 
                             webhook_info.url, 
                             webhook_info.pending_update_count)
                     
                     # Se webhook não está configurado, tem muitos pendentes ou tem erros
-                    expected_url = f"{WEBHOOK_URL}/{TOKEN}"
-                    if (webhook_info.url != expected_url or 
+                    if (webhook_info.url != WEBHOOK_FULL_URL or 
                         webhook_info.pending_update_count > 100 or
                         webhook_info.last_error_message):
                         
@@ -495,7 +640,7 @@ def webhook_watchdog():
                         # Tenta reconectar usando a nova função
                         try:
                             LOG.info("🔧 Reconectando webhook via watchdog...")
-                            if reconnect_webhook_sync():
+                            if await reconnect_webhook():
                                 LOG.info("✅ Webhook reconectado pelo watchdog!")
                                 LAST_ACTIVITY["telegram"] = time.time()
                             else:
@@ -545,40 +690,96 @@ def temp_file_guaranteed_cleanup(suffix='', prefix='ytdl_'):
             except Exception:
                 pass
 
-def cleanup_and_gc_routine():
+# Nomes de temporários removíveis (uma única regex em vez de endswith/startswith)
+TEMP_FILE_RE = re.compile(r"^ytdl_|\.(?:mp4|jpe?g|webm|png)$")
+DOWNLOAD_DIR_PREFIX = "ytbot_"
+
+# tmpfs em RAM para downloads pequenos: o arquivo baixado e relido no upload
+# não passa pelo disco. Páginas do tmpfs contam no limite de memória do
+# container, então é opt-in (USE_SHM=1) e limitado por um orçamento total
+# reservado entre downloads simultâneos (statvfs mostra o tamanho do tmpfs,
+# não o limite do cgroup)
+SHM_ENABLED = os.getenv("USE_SHM", "0") == "1"
+SHM_DIR = "/dev/shm" if SHM_ENABLED and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+SHM_MAX_FILE_SIZE = int(os.getenv("SHM_MAX_FILE_MB", "50")) * 1024 * 1024
+SHM_BUDGET = int(os.getenv("SHM_BUDGET_MB", "100")) * 1024 * 1024
+TEMP_ROOTS = ("/tmp", SHM_DIR) if SHM_DIR else ("/tmp",)
+_SHM_RESERVED = 0
+_SHM_LOCK = threading.Lock()
+
+def reserve_download_tmp_root(filesize: int | None) -> tuple[str | None, int]:
+    """Escolhe a base do tmpdir: (/dev/shm, bytes reservados) se couber no orçamento, senão (None, 0)"""
+    global _SHM_RESERVED
+    if not SHM_DIR or not filesize or filesize > SHM_MAX_FILE_SIZE:
+        return None, 0
+    # Folga para o arquivo original + o convertido pelo FFmpegVideoConvertor
+    needed = filesize * 3
+    with _SHM_LOCK:
+        if _SHM_RESERVED + needed > SHM_BUDGET:
+            return None, 0
+        _SHM_RESERVED += needed
+    return SHM_DIR, needed
+
+def release_download_tmp_root(reserved: int):
+    """Devolve ao orçamento do /dev/shm o que foi reservado para um download"""
+    global _SHM_RESERVED
+    if reserved:
+        with _SHM_LOCK:
+            _SHM_RESERVED -= reserved
+
+def _cleanup_temp_files(active_tmpdirs: frozenset = frozenset()) -> int:
+    """Remove arquivos temporários com mais de 1 hora (I/O bloqueante)"""
+    one_hour_ago = time.time() - 3600
+    cleaned_count = 0
+    
+    # Uma varredura por raiz; DirEntry reaproveita o tipo do readdir (sem stat extra)
+    for root in TEMP_ROOTS:
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    name = entry.name
+                    try:
+                        if name.startswith(DOWNLOAD_DIR_PREFIX):
+                            # tmpdir de download abandonado (ex.: processo reiniciado).
+                            # O mtime do diretório não muda enquanto um .part cresce,
+                            # então downloads em andamento são pulados explicitamente
+                            if entry.path in active_tmpdirs:
+                                continue
+                            if entry.is_dir(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < one_hour_ago:
+                                shutil.rmtree(entry.path, ignore_errors=True)
+                                cleaned_count += 1
+                            continue
+                        if not TEMP_FILE_RE.search(name):
+                            continue
+                        if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < one_hour_ago:
+                            os.unlink(entry.path)
+                            cleaned_count += 1
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+    return cleaned_count
+
+async def cleanup_and_gc_routine():
     """
-    Thread daemon que executa periodicamente:
+    Tarefa no APP_LOOP que executa periodicamente:
     1. Limpeza de arquivos temporários antigos
     2. Garbage collection forçado
     OTIMIZADO: Executa a cada 30 minutos (reduz CPU em 66%)
     """
     while True:
-        time.sleep(1800)  # 30 minutos (otimizado de 600s)
+        await asyncio.sleep(1800)  # 30 minutos (otimizado de 600s)
         
         try:
             # Garbage collection - OTIMIZADO: Apenas geração 0 (5-10x mais rápido)
-            collected = gc.collect(0)
+            collected = await asyncio.get_running_loop().run_in_executor(GC_EXEC, gc.collect, 0)
             if collected > 0:
                 print(f"🗑️ GC: {collected} objetos coletados")
             
             # Limpeza de arquivos temporários - OTIMIZADO: 1 varredura em vez de 6
-            one_hour_ago = time.time() - 3600
-            cleaned_count = 0
-            
-            # Varre /tmp apenas 1 vez (83% menos I/O)
-            try:
-                for filename in os.listdir('/tmp'):
-                    if filename.endswith(('.mp4', '.jpg', '.jpeg', '.webm', '.png')) or \
-                       filename.startswith('ytdl_'):
-                        filepath = os.path.join('/tmp', filename)
-                        try:
-                            if os.path.getmtime(filepath) < one_hour_ago:
-                                os.unlink(filepath)
-                                cleaned_count += 1
-                        except Exception:
-                            pass
-            except Exception:
-                pass
+            # Snapshot no loop (ACTIVE_DOWNLOADS só muda aqui) antes de ir para a thread
+            active_tmpdirs = frozenset(d.tmpdir for d in ACTIVE_DOWNLOADS.values() if d.tmpdir)
+            cleaned_count = await asyncio.to_thread(_cleanup_temp_files, active_tmpdirs)
             
             if cleaned_count > 0:
                 print(f"🧹 Limpeza: {cleaned_count} arquivos temporários removidos")
@@ -588,7 +789,7 @@ def cleanup_and_gc_routine():
             orphan_downloads = []
             
             for token, info in ACTIVE_DOWNLOADS.items():
-                if now - info.get('start_time', now) > 1800:  # 30 minutos
+                if now - info.started_at > 1800:  # 30 minutos
                     orphan_downloads.append(token)
             
             for token in orphan_downloads:
@@ -603,6 +804,180 @@ def cleanup_and_gc_routine():
 # SHOPEE VIDEO EXTRACTOR - SEM MARCA D'ÁGUA
 # ============================================================
 
+# Regexes e headers são imutáveis: compilados/montados uma única vez no import
+_BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+SHOPEE_ID_PATTERNS = (
+    re.compile(r'/product/(\d+)/(\d+)'),
+    re.compile(r'-i\.(\d+)\.(\d+)'),
+    re.compile(r'\.i\.(\d+)\.(\d+)'),
+)
+SHOPEE_WATERMARK_RE = re.compile(r'\.\d+\.\d+(?=\.)')
+NEXT_DATA_RE = re.compile(r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>', re.DOTALL)
+
+# Padrões usados por ShopeeVideoExtractor.extract_video_from_html
+SHOPEE_HTML_VIDEO_PATTERNS = (
+    re.compile(r'"video_url"\s*:\s*"([^"]+)"'),
+    re.compile(r'"url"\s*:\s*"(https://[^"]*\.[^"]*)"'),
+    re.compile(r'(https://cf\.shopee\.com\.br/file/[a-zA-Z0-9_-]+)'),
+    re.compile(r'(https://[^"\']*shopee[^"\']*\.[^"\']*)'),
+)
+
+# Padrões usados por extract_shopee_video_direct
+SHOPEE_DIRECT_VIDEO_PATTERNS = (
+    re.compile(r'"video_url"\s*:\s*"([^"]+)"'),
+    re.compile(r'"url"\s*:\s*"(https://[^"]*\.mp4[^"]*)"'),
+    re.compile(r'https://cf\.shopee\.com\.br/file/[a-zA-Z0-9]+'),
+    re.compile(r'https://[^"\']*shopee[^"\']*\.mp4[^"\']*'),
+)
+
+# Padrões usados pelo scraping de fallback em _download_shopee_video
+SHOPEE_PAGE_VIDEO_PATTERNS = (
+    # Padrões comuns da Shopee
+    re.compile(r'"videoUrl"\s*:\s*"([^"]+)"'),
+    re.compile(r'"video_url"\s*:\s*"([^"]+)"'),
+    re.compile(r'"playAddr"\s*:\s*"([^"]+)"'),
+    re.compile(r'"url"\s*:\s*"(https://[^"]*\.mp4[^"]*)"'),
+    # Padrões do domínio específico
+    re.compile(r'(https://down-[^"]*\.vod\.susercontent\.com[^"]*)'),
+    re.compile(r'(https://[^"]*susercontent\.com[^"]*\.mp4[^"]*)'),
+    re.compile(r'(https://cf\.shopee\.com\.br/file/[^"]+)'),
+    # Padrão watermarkVideoUrl
+    re.compile(r'"watermarkVideoUrl"\s*:\s*"([^"]+)"'),
+    re.compile(r'"defaultFormat"[^}]*"url"\s*:\s*"([^"]+)"'),
+)
+
+# Headers de navegador para expandir links encurtados
+SHORT_URL_HEADERS = {
+    'User-Agent': _BROWSER_USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'pt-BR,pt;q=0.9,en;q=0.8',
+}
+
+# Headers para páginas/vídeos da Shopee baixados via requests
+SHOPEE_DIRECT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Referer': 'https://shopee.com.br/',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+}
+SHOPEE_DOWNLOAD_HEADERS = {
+    "User-Agent": _BROWSER_USER_AGENT,
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Referer": "https://shopee.com.br/",
+}
+
+# Opções base do yt-dlp para extração de informações (sem download)
+YDL_INFO_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": False,
+    "no_check_certificate": True,
+    "prefer_insecure": True,
+    # OTIMIZAÇÃO #3: Reduz uso de memória do yt-dlp (50-70% menos RAM)
+    "no_cache_dir": True,  # Desabilita cache em disco
+    "extractor_retries": 4,  # Aumentado para melhor resiliência
+    "fragment_retries": 4,   # Aumentado para melhor resiliência
+    "buffersize": 1024 * 64,  # 64KB buffer (padrão: 1024KB)
+    "ignore_no_formats_error": True,
+    # 🔧 FIX CONEXÃO YOUTUBE: Aumenta timeouts e retries para evitar "Connection refused"
+    "socket_timeout": 60,  # 60s timeout (aumentado de 30s)
+    "http_chunk_size": 262144,  # 256KB chunks (mais estável)
+    "retries": 25,  # ✅ CORRIGIDO: Número simples (não dicionário)
+    "skip_unavailable_fragments": True,  # Evita falhar com fragmentos indisponíveis
+    "force_ipv4": True,  # Força IPv4 (mais estável)
+    # Headers padrão para evitar bloqueios
+    "http_headers": {
+        "User-Agent": _BROWSER_USER_AGENT,
+        "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
+    },
+}
+
+# Configurações específicas para Shopee na extração de informações
+SHOPEE_YDL_INFO_OPTS = {
+    "http_headers": {
+        "User-Agent": _BROWSER_USER_AGENT,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
+        "Referer": "https://shopee.com.br/",
+        "Origin": "https://shopee.com.br",
+    },
+    "socket_timeout": 60,
+    "retries": 25,  # ✅ CORRIGIDO: Número simples
+}
+
+# Configurações específicas para Shopee no download
+SHOPEE_YDL_DOWNLOAD_OPTS = {
+    "http_headers": {
+        "User-Agent": _BROWSER_USER_AGENT,
+        "Accept": "*/*",
+        "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Referer": "https://shopee.com.br/",
+        "Origin": "https://shopee.com.br",
+        "Sec-Fetch-Dest": "video",
+        "Sec-Fetch-Mode": "no-cors",
+        "Sec-Fetch-Site": "cross-site",
+    },
+    "extractor_args": {
+        "shopee": {
+            "api_ver": "v4"
+        }
+    },
+    # Força download direto sem fragmentação
+    "noprogress": False,
+    "keep_fragments": False,
+    "socket_timeout": 60,  # Aumentado para Shopee também
+    "retries": 25,  # ✅ CORRIGIDO: Número simples
+}
+
+# Opções base do yt-dlp para download (outtmpl, progress_hooks e format são
+# adicionados por download em _do_download)
+YDL_BASE_OPTS = {
+    "quiet": False,
+    "logger": LOG,
+    "format_sort": ["res", "ext:mp4:m4a"],
+    "ignore_no_formats_error": True,
+    "merge_output_format": "mp4",
+    "concurrent_fragment_downloads": 1,
+    "force_ipv4": True,
+    "socket_timeout": 60,
+    "http_chunk_size": 262144,
+    "retries": 25,
+    "fragment_retries": 25,
+    "no_check_certificate": True,
+    "prefer_insecure": True,
+    "no_cache_dir": True,
+    "buffersize": 1024 * 64,
+    "skip_unavailable_fragments": True,
+    "postprocessors": [{
+        'key': 'FFmpegVideoConvertor',
+        'preferedformat': 'mp4',
+    }],
+    "keepvideo": False,
+    "prefer_ffmpeg": True,
+}
+
+SHOPEE_URL_KINDS = ("shopee", "sv_shopee")
+
+# Padrões de plataforma em ordem de prioridade (IGNORECASE evita url.lower())
+URL_KIND_PATTERNS = (
+    ("sv_shopee", re.compile(r"sv\.shopee|share-video", re.IGNORECASE)),
+    ("shopee", re.compile(r"shopee|shope\.ee", re.IGNORECASE)),
+    ("instagram", re.compile(r"insta", re.IGNORECASE)),
+    ("youtube", re.compile(r"youtube|youtu\.be", re.IGNORECASE)),
+)
+SHOPEE_UNIVERSAL_LINK_RE = re.compile(r"universal-link")
+SHOPEE_SHORT_LINK_RE = re.compile(r"shp\.ee|shope\.ee", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1024)
+def url_kind(url: str) -> str:
+    """Classifica a URL uma única vez: sv_shopee, shopee, instagram, youtube ou other"""
+    for kind, pattern in URL_KIND_PATTERNS:
+        if pattern.search(url):
+            return kind
+    return "other"
+
 class ShopeeVideoExtractor:
     """Extrator de vídeos da Shopee sem marca d'água usando API interna"""
     
@@ -616,13 +991,8 @@ class ShopeeVideoExtractor:
     
     def extract_ids(self, url: str):
         """Extrai shop_id e item_id da URL"""
-        patterns = [
-            r'/product/(\d+)/(\d+)',
-            r'-i\.(\d+)\.(\d+)',
-            r'\.i\.(\d+)\.(\d+)',
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, url)
+        for pattern in SHOPEE_ID_PATTERNS:
+            match = pattern.search(url)
             if match:
                 return (match.group(1), match.group(2))
         return None
@@ -636,7 +1006,7 @@ class ShopeeVideoExtractor:
             return None
         
         # Remove .NUMERO.NUMERO antes de .
-        clean_url = re.sub(r'\.\d+\.\d+(?=\.)', '', video_url)
+        clean_url = SHOPEE_WATERMARK_RE.sub('', video_url)
         
         if clean_url != video_url:
             LOG.info("✨ Marca d'água removida da URL")
@@ -661,16 +1031,14 @@ class ShopeeVideoExtractor:
             html = response.text
             
             # Extrai __NEXT_DATA__ script tag
-            pattern = r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>'
-            match = re.search(pattern, html, re.DOTALL)
+            match = NEXT_DATA_RE.search(html)
             
             if not match:
                 LOG.warning("⚠️ __NEXT_DATA__ não encontrado")
                 return None
             
             # Parse JSON
-            import json
-            data = json.loads(match.group(1))
+            data = json_loads(match.group(1))
             LOG.info("✅ __NEXT_DATA__ extraído com sucesso!")
             
             # Navega no JSON para encontrar vídeo
@@ -725,15 +1093,8 @@ class ShopeeVideoExtractor:
             html = response.text
             
             # Padrões para encontrar URL do vídeo
-            patterns = [
-                r'"video_url"\s*:\s*"([^"]+)"',
-                r'"url"\s*:\s*"(https://[^"]*\.[^"]*)"',
-                r'(https://cf\.shopee\.com\.br/file/[a-zA-Z0-9_-]+)',
-                r'(https://[^"\']*shopee[^"\']*\.[^"\']*)',
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, html)
+            for pattern in SHOPEE_HTML_VIDEO_PATTERNS:
+                matches = pattern.findall(html)
                 if matches:
                     video_url = matches[0].replace('\\/', '/')
                     LOG.info("✅ URL de vídeo encontrada no HTML!")
@@ -766,7 +1127,7 @@ class ShopeeVideoExtractor:
             LOG.info("⚠️ __NEXT_DATA__ falhou, tentando outros métodos...")
             
             # 🔧 MÉTODO 2: Se for URL de vídeo (sv.shopee.com.br), usa extração HTML
-            if 'sv.shopee' in url.lower() or 'share-video' in url.lower():
+            if url_kind(url) == "sv_shopee":
                 LOG.info("🎬 MÉTODO 2: URL de vídeo direto (sv.shopee.com.br)")
                 return self.extract_video_from_html(url)
             
@@ -963,8 +1324,8 @@ class WatermarkRemover:
 WATERMARK_REMOVER = WatermarkRemover()
 
 
-from flask import Flask, request, jsonify
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from flask import Flask, Response, request, jsonify
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -974,6 +1335,9 @@ from telegram.ext import (
     filters,
 )
 
+# Tipos de update que o bot trata (webhook e long-polling)
+ALLOWED_UPDATES = (Update.MESSAGE, Update.CALLBACK_QUERY)
+
 # ✅ Logging já configurado anteriormente (linha 202)
 # NÃO adicionar basicConfig aqui para evitar duplicação de handlers!
 
@@ -986,6 +1350,17 @@ if not TOKEN:
 
 LOG.info("TELEGRAM_BOT_TOKEN presente (len=%d).", len(TOKEN))
 
+# URL completa do webhook (comparada pelo watchdog a cada verificação)
+WEBHOOK_FULL_URL = f"{WEBHOOK_URL}/{TOKEN}" if WEBHOOK_URL else None
+
+# Parâmetros fixos do setWebhook, montados uma vez (inicialização e reconexões)
+SET_WEBHOOK_ARGS = {
+    "url": WEBHOOK_FULL_URL,
+    "max_connections": WEBHOOK_MAX_CONN,
+    "allowed_updates": ALLOWED_UPDATES,
+    "secret_token": WEBHOOK_SECRET,
+}
+
 # 🔐 ID DO ADMINISTRADOR - Apenas este usuário pode usar /mensal e /stats
 ADMIN_ID = 6766920288  # ← ALTERE AQUI se necessário
 
@@ -1002,12 +1377,80 @@ SPLIT_SIZE = 45 * 1024 * 1024
 FREE_DOWNLOADS_LIMIT = 3
 MAX_CONCURRENT_DOWNLOADS = 3  # Até 3 downloads simultâneos
 
+# Pool próprio para os downloads do yt-dlp: downloads longos não ocupam o
+# executor padrão usado pelos demais asyncio.to_thread (SQLite, HTTP, arquivos)
+YTDLP_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS + 2, thread_name_prefix="ytdlp")
+atexit.register(YTDLP_EXECUTOR.shutdown, wait=False)
+
 # Configuração do Mercado Pago
 MERCADOPAGO_ACCESS_TOKEN = os.getenv("MERCADOPAGO_ACCESS_TOKEN")
 PREMIUM_PRICE = float(os.getenv("PREMIUM_PRICE", "9.90"))
 PREMIUM_DURATION_DAYS = int(os.getenv("PREMIUM_DURATION_DAYS", "30"))
 
+# Monitoramento de pagamento: o webhook /webhook/pix é o caminho principal;
+# um único poller consulta todos os PIX pendentes numa busca só, com
+# intervalo crescente (5s, 10s, 20s, 40s, 80s, 120s...) que volta a 5s a
+# cada novo pagamento
+PAYMENT_MONITOR_TIMEOUT = 1800  # 30 minutos
+PAYMENT_POLL_INITIAL_DELAY = 5
+PAYMENT_POLL_MAX_DELAY = 120
+PAYMENT_POLL_JITTER = 0.1  # Até +10% aleatório para não sincronizar consultas
+PAYMENT_SEARCH_LIMIT = 100
+PENDING_PAYMENTS = {}  # payment_id (str) -> {"user_id": int, "expires_at": float}
+PAYMENT_POLLER = {"task": None, "delay": PAYMENT_POLL_INITIAL_DELAY}
+PAYMENT_POLLER_WAKE = asyncio.Event()  # Sinalizado pelo webhook /webhook/pix
+
+MP_SDK = None
+MP_CLIENT = None  # httpx.AsyncClient para a API REST (usado no event loop do bot)
+MP_API_URL = "https://api.mercadopago.com"
+
+def _create_mp_sdk():
+    """Importa o SDK do Mercado Pago e cria o cliente com Session persistente"""
+    mercadopago = importlib.import_module("mercadopago")
+    from mercadopago.http.http_client import HttpClient
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    class PooledMercadoPagoHttpClient(HttpClient):
+        """HttpClient do SDK com requests.Session persistente (keep-alive).
+
+        O cliente padrão cria e fecha uma Session por chamada, refazendo o
+        handshake TCP/TLS a cada consulta do monitoramento de pagamento.
+        """
+
+        def __init__(self):
+            self.session = requests.Session()
+            self.session.mount("https://", HTTPAdapter(
+                pool_connections=10,
+                pool_maxsize=20,
+                max_retries=Retry(total=3, status_forcelist=[429, 500, 502, 503, 504]),
+            ))
+
+        def request(self, method, url, maxretries=None, **kwargs):
+            api_result = self.session.request(method, url, **kwargs)
+            response = {"status": api_result.status_code, "response": None}
+            if api_result.status_code != 204 and api_result.content:
+                try:
+                    response["response"] = api_result.json()
+                except ValueError as e:
+                    LOG.error("Resposta inválida do Mercado Pago: %s", e)
+            return response
+
+    return mercadopago.SDK(MERCADOPAGO_ACCESS_TOKEN, http_client=PooledMercadoPagoHttpClient())
+
 if MERCADOPAGO_AVAILABLE and MERCADOPAGO_ACCESS_TOKEN:
+    # SDK único para todo o processo (importado e criado no primeiro uso)
+    MP_SDK = LazyClient(_create_mp_sdk)
+
+    # Cliente assíncrono (httpx já vem com o python-telegram-bot): criação e
+    # consulta de pagamentos no event loop sem ocupar threads
+    import httpx
+    MP_CLIENT = httpx.AsyncClient(
+        base_url=MP_API_URL,
+        headers={"Authorization": f"Bearer {MERCADOPAGO_ACCESS_TOKEN}"},
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+    )
     LOG.info("✅ Mercado Pago configurado - Token: %s...", MERCADOPAGO_ACCESS_TOKEN[:20])
 else:
     if not MERCADOPAGO_AVAILABLE:
@@ -1019,13 +1462,17 @@ else:
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 groq_client = None
 
+# Modelos do Groq: prompts curtos (classificações de uma palavra) vão para o
+# modelo rápido; conversas e resumos usam o modelo principal. Ambos usam o
+# 8B por padrão — um modelo maior (ex: llama-3.3-70b-versatile) é opt-in via env
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+GROQ_FAST_MODEL = os.getenv("GROQ_FAST_MODEL", "llama-3.1-8b-instant")
+GROQ_FAST_PROMPT_CHARS = 600  # Prompt total (sistema + usuário) abaixo disso usa o modelo rápido
+
 if GROQ_AVAILABLE and GROQ_API_KEY:
-    try:
-        groq_client = Groq(api_key=GROQ_API_KEY)
-        LOG.info("✅ Groq AI configurado - Inteligência artificial ativa!")
-    except Exception as e:
-        LOG.error("❌ Erro ao inicializar Groq: %s", e)
-        groq_client = None
+    # O pacote groq só é importado na primeira chamada à IA
+    groq_client = LazyClient(lambda: importlib.import_module("groq").Groq(api_key=GROQ_API_KEY))
+    LOG.info("✅ Groq AI configurado - Inteligência artificial ativa!")
 else:
     if not GROQ_AVAILABLE:
         LOG.warning("⚠️ groq não instalado - pip install groq")
@@ -1034,29 +1481,92 @@ else:
 
 # Estado Global
 PENDING = LimitedCache(max_size=200)  # OTIMIZADO: Reduzido de 1000 para economizar memória (~80% menos RAM)
-DB_LOCK = threading.Lock()
+PENDING_EXPIRY_HEAP = []  # Min-heap (expira_em, token) para _cleanup_pending
+# Extrações do yt-dlp reaproveitadas no download, fora do PENDING: cada uma
+# carrega a lista completa de formatos (dezenas de dicts com URLs, headers e
+# às vezes fragmentos), então só as mais recentes ficam guardadas. Token sem
+# entrada aqui simplesmente extrai de novo na hora do download
+PENDING_INFO_MAX = int(os.getenv("PENDING_INFO_MAX", "10"))
+PENDING_INFO = LimitedCache(max_size=PENDING_INFO_MAX)
 DOWNLOAD_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)  # Controle de fila
-ACTIVE_DOWNLOADS = {}  # Rastreamento de downloads ativos
+ACTIVE_DOWNLOADS: dict[str, ActiveDownload] = {}  # Rastreamento de downloads ativos
 DOWNLOAD_HISTORY = deque(maxlen=100)  # Histórico limitado aos últimos 100 downloads
 # USER_LAST_DOWNLOAD já está definido acima como LimitedCache(max_size=50) - não redefina aqui!
 
+# Pool de conexões SQLite: reutiliza conexões abertas em vez de reabrir o
+# arquivo (e esfriar o cache de páginas) a cada consulta. LIFO: a conexão
+# devolvida por último (cache mais quente) é a próxima a ser emprestada
+DB_POOL_SIZE = 4
+DB_READ_POOL_SIZE = 4
+_DB_POOL = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_DB_READ_POOL = queue.LifoQueue(maxsize=DB_READ_POOL_SIZE)
+DB_MMAP_SIZE = 64 * 1024 * 1024  # leituras via mmap em vez de read() por página
+DB_WAL_ENABLED = True  # Confirmado no init_db; sem WAL os leitores usam o pool de escrita
+
+def _tune_db_connection(conn):
+    """PRAGMAs por conexão (journal_mode=WAL é persistente e fica no init_db)"""
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    return conn
+
+def _new_db_connection():
+    """Abre uma conexão para o pool (pode ser usada por qualquer thread)"""
+    # timeout=10 é o busy timeout: com WAL, escritores concorrentes esperam o
+    # lock do próprio SQLite em vez de um lock global do Python
+    conn = sqlite3.connect(DB_FILE, timeout=10, check_same_thread=False, cached_statements=128)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return _tune_db_connection(conn)
+
+def _new_db_reader():
+    """Abre uma conexão somente leitura (SELECTs; com WAL não disputa com escritores)"""
+    conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, timeout=10, check_same_thread=False, cached_statements=128)
+    conn.execute("PRAGMA query_only=1")
+    return _tune_db_connection(conn)
+
+def db_conn():
+    """Empresta uma conexão de escrita do pool; faz rollback se houver erro"""
+    return _pooled_conn(_DB_POOL, _new_db_connection)
+
+def db_reader():
+    """Empresta uma conexão somente leitura do pool"""
+    if not DB_WAL_ENABLED:
+        # Sem WAL, leitores extras só disputariam o lock do arquivo com o escritor
+        return db_conn()
+    return _pooled_conn(_DB_READ_POOL, _new_db_reader)
+
+@contextmanager
+def _pooled_conn(pool, factory):
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = factory()
+    
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            conn = None
+        raise
+    finally:
+        if conn is not None:
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
 @contextmanager
 def get_db_connection():
-    """Context manager para conexões DB com garantia de fechamento"""
-    conn = None
+    """Context manager para conexões DB com commit automático"""
     try:
-        with DB_LOCK:
-            conn = sqlite3.connect(DB_FILE, timeout=5)
+        with db_conn() as conn:
             yield conn
             conn.commit()
     except Exception as e:
-        if conn:
-            conn.rollback()
         LOG.error("Erro no banco de dados: %s", e)
         raise
-    finally:
-        if conn:
-            conn.close()
 
 # Mensagens Profissionais do Bot
 MESSAGES = {
@@ -1121,24 +1631,49 @@ MESSAGES = {
     "cleanup": "Aproveite o seu vídeo.",
 }
 
+# Barras de progresso pré-montadas (índice = blocos de 5%)
+PROGRESS_BARS = tuple("█" * i + "░" * (20 - i) for i in range(21))
+PROGRESS_EDIT_INTERVAL = 2.0  # Intervalo mínimo entre edições de progresso (rate limit do Telegram)
+
 app = Flask(__name__)
 
+if ORJSON_AVAILABLE:
+    from flask.json.provider import DefaultJSONProvider
+
+    class ORJSONProvider(DefaultJSONProvider):
+        """JSON do Flask (request.get_json / jsonify) via orjson"""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = ORJSONProvider(app)
+
 # Inicialização do Telegram Application
 from telegram.request import HTTPXRequest
 
+# Updates processados em paralelo pelo fetcher do Application
+UPDATE_CONCURRENCY = 256
+
 # Inicialização do Telegram Application
 try:
     request = HTTPXRequest(
         connect_timeout=30,   # tempo para conectar ao Telegram
         read_timeout=600,     # tempo esperando resposta do Telegram
         write_timeout=600,    # tempo enviando o vídeo (o mais importante)
-        pool_timeout=30
+        pool_timeout=30,
+        connection_pool_size=BOT_POOL_SIZE,  # keep-alive reaproveitado pelos send_*
+        # HTTP/2: chamadas concorrentes multiplexadas na mesma conexão TLS
+        http_version="2" if HTTP2_AVAILABLE else "1.1"
     )
 
     application = (
         ApplicationBuilder()
         .token(TOKEN)
         .request(request)
+        .concurrent_updates(UPDATE_CONCURRENCY)  # downloads longos não bloqueiam os outros updates
         .build()
     )
 
@@ -1148,7 +1683,123 @@ except Exception as e:
     LOG.exception("Erro ao construir ApplicationBuilder")
     sys.exit(1)
 
+# ════════════════════════════════════════════════════════════════
+# ⚙️ POOL DE PROCESSOS PARA EXTRAÇÃO (yt-dlp)
+# ════════════════════════════════════════════════════════════════
+# extract_info faz parsing de JSON/HTML/JS (CPU) — em threads, extrações
+# simultâneas disputam o GIL. Em processos separados rodam em paralelo.
+YDL_PROCESS_WORKERS = int(os.getenv("YDL_PROCESS_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+_YDL_POOL = None
+_YDL_POOL_LOCK = threading.Lock()
+
+def _start_ydl_process_pool():
+    """Cria o pool e já faz o fork dos workers (chamado antes de qualquer thread existir)"""
+    global _YDL_POOL
+    # fork: o filho herda o módulo já carregado (sem reimportar e sem
+    # reinicializar o bot/Flask). Por isso o fork acontece aqui, no import,
+    # antes do APP_LOOP, do servidor e dos executors: um processo com várias
+    # threads poderia ser copiado com um lock (logging, httpx, sqlite) preso.
+    # gc.freeze() antes do fork: o GC dos filhos (e do pai) deixa de tocar os
+    # objetos herdados, que continuam páginas compartilhadas (copy-on-write).
+    # Medido com 2 workers após instanciar o YoutubeDL: USS de cada filho
+    # cai de ~38MB para ~13MB; ociosos, os filhos ficam em ~2MB de USS
+    gc.freeze()
+    _YDL_POOL = ProcessPoolExecutor(
+        max_workers=YDL_PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context("fork"),
+    )
+    # Com fork, o primeiro submit cria todos os workers de uma vez
+    _YDL_POOL.submit(os.getpid)
+    LOG.info("⚙️ Pool de processos do yt-dlp criado (workers=%d)", YDL_PROCESS_WORKERS)
+
+def get_ydl_process_pool():
+    """Retorna o pool de processos do yt-dlp, ou None se ele quebrou"""
+    return _YDL_POOL
+
+def _reset_ydl_process_pool():
+    """Descarta o pool após um worker morrer (ex: OOM).
+
+    Não recria: um novo fork agora partiria do processo já multi-thread.
+    As extrações seguintes rodam em thread (_extract_info_direct).
+    """
+    global _YDL_POOL
+    with _YDL_POOL_LOCK:
+        if _YDL_POOL is not None:
+            _YDL_POOL.shutdown(wait=False, cancel_futures=True)
+            _YDL_POOL = None
+
+# Instâncias de YoutubeDL por conjunto de opções, vivas em cada processo do
+# pool (cada worker roda uma extração por vez, então não precisa de lock).
+# Cada entrada guarda o mtime do cookiefile com que foi criada: se o arquivo
+# mudar no disco (outro worker salvou, cookies novos), a instância é recriada
+_WORKER_YDL: dict[str, tuple[yt_dlp.YoutubeDL, int | None]] = {}
+_WORKER_YDL_MAX = 8
+
+def _cookie_mtime(ydl_opts: dict):
+    """mtime (ns) do cookiefile das opções, ou None"""
+    path = ydl_opts.get("cookiefile")
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _discard_worker_ydl(key: str, save_cookies: bool):
+    """Remove e fecha a instância em cache (salvando cookies só se o jar for o atual)"""
+    ydl, _ = _WORKER_YDL.pop(key)
+    if not save_cookies:
+        # Arquivo trocado no disco: close() não deve sobrescrevê-lo com o jar antigo
+        ydl.params["cookiefile"] = None
+    try:
+        ydl.close()
+    except Exception:
+        pass
+
+def _worker_ydl(ydl_opts: dict):
+    """YoutubeDL reaproveitado entre extrações (extratores e sessão HTTP já prontos)"""
+    key = repr(sorted(ydl_opts.items()))
+    entry = _WORKER_YDL.get(key)
+    if entry is not None and entry[1] != _cookie_mtime(ydl_opts):
+        _discard_worker_ydl(key, save_cookies=False)
+        entry = None
+    if entry is None:
+        if len(_WORKER_YDL) >= _WORKER_YDL_MAX:
+            _discard_worker_ydl(next(iter(_WORKER_YDL)), save_cookies=True)
+        entry = _WORKER_YDL[key] = (yt_dlp.YoutubeDL(ydl_opts), _cookie_mtime(ydl_opts))
+    return key, entry[0]
+
+def _extract_info_worker(url: str, ydl_opts: dict) -> dict:
+    """Executa extract_info no processo filho (YoutubeDL não é serializável)"""
+    key, ydl = _worker_ydl(ydl_opts)
+    try:
+        info = ydl.extract_info(url, download=False)
+        # sanitize_info garante um dict serializável para voltar ao processo pai
+        result = ydl.sanitize_info(info)
+    except Exception:
+        # Estado possivelmente inconsistente: fecha (salva cookies, como o antigo
+        # bloco with) e a próxima extração cria uma instância nova
+        _discard_worker_ydl(key, save_cookies=True)
+        raise
+    if ydl_opts.get("cookiefile"):
+        # Cookies rotacionados pelo extrator voltam ao arquivo a cada extração
+        ydl.save_cookies()
+        _WORKER_YDL[key] = (ydl, _cookie_mtime(ydl_opts))
+    return result
+
+def _extract_info_direct(url: str, ydl_opts: dict) -> dict:
+    """Extração em thread do próprio processo (fallback sem o pool)"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+_start_ydl_process_pool()
+
 # Loop de Eventos Asyncio
+if UVLOOP_AVAILABLE:
+    # A policy precisa estar ativa antes de criar o APP_LOOP
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    LOG.info("⚡ uvloop ativado para o event loop")
 APP_LOOP = asyncio.new_event_loop()
 
 def _start_loop(loop):
@@ -1160,10 +1811,35 @@ LOG.info("Iniciando event loop de background...")
 loop_thread = threading.Thread(target=_start_loop, args=(APP_LOOP,), daemon=True)
 loop_thread.start()
 
+def run_on_loop(coro, timeout: float = 10):
+    """Executa a corrotina no APP_LOOP e espera o resultado (só na inicialização)"""
+    future = asyncio.run_coroutine_threadsafe(coro, APP_LOOP)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        # Não deixa a corrotina órfã rodando no loop depois do timeout
+        future.cancel()
+        raise
+
+def run_on_loop_retry(coro_factory, tries: int = 2, timeout: float = 3):
+    """Como run_on_loop, com timeout curto e nova tentativa (chamadas idempotentes)"""
+    for attempt in range(1, tries + 1):
+        future = asyncio.run_coroutine_threadsafe(coro_factory(), APP_LOOP)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            if attempt == tries:
+                raise
+            LOG.warning("⚠️ Timeout de %.0fs na inicialização - nova tentativa (%d/%d)", timeout, attempt + 1, tries)
+
 try:
-    fut = asyncio.run_coroutine_threadsafe(application.initialize(), APP_LOOP)
-    fut.result(timeout=30)
+    run_on_loop(application.initialize(), timeout=30)
     LOG.info("Application inicializada.")
+    # initialize() já chamou get_me: identidade do bot fica em cache no módulo
+    BOT_USERNAME = application.bot.username
+    BOT_ID = application.bot.id
+    LOG.info("🤖 Bot: @%s", BOT_USERNAME)
 except Exception as e:
     LOG.exception("Falha ao inicializar Application")
     sys.exit(1)
@@ -1174,58 +1850,101 @@ except Exception as e:
 
 def init_db():
     """Inicializa o banco de dados com as tabelas necessárias"""
-    with DB_LOCK:
+    global DB_WAL_ENABLED
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=10)
+        c = conn.cursor()
+        
+        # WAL: leitores não bloqueiam o escritor (modo persistente no arquivo)
+        journal_mode = c.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        DB_WAL_ENABLED = journal_mode.lower() == "wal"
+        if not DB_WAL_ENABLED:
+            LOG.warning("⚠️ SQLite sem WAL (journal_mode=%s) - leituras usarão o pool de escrita", journal_mode)
+        c.execute("PRAGMA synchronous=NORMAL")
+        
+        # Tabela de usuários mensais
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_users (
+                user_id INTEGER PRIMARY KEY,
+                last_month TEXT
+            )
+        """)
+        
+        # Tabela de controle de downloads
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS user_downloads (
+                user_id INTEGER PRIMARY KEY,
+                downloads_count INTEGER DEFAULT 0,
+                is_premium INTEGER DEFAULT 0,
+                premium_expires TEXT,
+                last_reset TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Tabela de histórico de pagamentos PIX (para implementação futura)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS pix_payments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                pix_key TEXT,
+                status TEXT DEFAULT 'pending',
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                confirmed_at TEXT,
+                FOREIGN KEY (user_id) REFERENCES user_downloads(user_id)
+            )
+        """)
+        
+        # Um registro por pagamento do Mercado Pago (chave de idempotência)
         try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
-            c = conn.cursor()
-            
-            # Tabela de usuários mensais
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS monthly_users (
-                    user_id INTEGER PRIMARY KEY,
-                    last_month TEXT
-                )
-            """)
-            
-            # Tabela de controle de downloads
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_downloads (
-                    user_id INTEGER PRIMARY KEY,
-                    downloads_count INTEGER DEFAULT 0,
-                    is_premium INTEGER DEFAULT 0,
-                    premium_expires TEXT,
-                    last_reset TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Tabela de histórico de pagamentos PIX (para implementação futura)
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS pix_payments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    amount REAL NOT NULL,
-                    pix_key TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    confirmed_at TEXT,
-                    FOREIGN KEY (user_id) REFERENCES user_downloads(user_id)
-                )
-            """)
-            
-            conn.commit()
-            conn.close()
-            LOG.info("Banco de dados inicializado com sucesso.")
-        except sqlite3.Error as e:
-            LOG.error("Erro ao inicializar banco de dados: %s", e)
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_pix_payments_pix_key ON pix_payments(pix_key)")
+        except sqlite3.IntegrityError as e:
+            LOG.warning("Pagamentos duplicados em pix_payments, índice único não criado: %s", e)
+        
+        # Cache persistente de resumos de vídeo gerados pela IA
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS video_summaries (
+                video_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            )
+        """)
+        
+        conn.commit()
+        conn.close()
+        LOG.info("Banco de dados inicializado com sucesso.")
+    except sqlite3.Error as e:
+        LOG.error("Erro ao inicializar banco de dados: %s", e)
+
+# (próxima meia-noite local em epoch, "AAAA-MM-DD", "AAAA-Wss"): as chaves de
+# data só são reformatadas quando time.time() passa da meia-noite
+_CALENDAR_KEYS = (0.0, "", "")
+
+def calendar_keys() -> tuple[str, str]:
+    """Retorna (hoje, semana atual) com comparação de epoch em vez de strftime por chamada"""
+    global _CALENDAR_KEYS
+    now = time.time()
+    keys = _CALENDAR_KEYS
+    if now >= keys[0]:
+        lt = time.localtime(now)
+        midnight = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        keys = _CALENDAR_KEYS = (midnight, time.strftime("%Y-%m-%d", lt), time.strftime("%Y-W%W", lt))
+    return keys[1], keys[2]
+
+# Última semana já gravada por usuário: mensagens seguintes na mesma semana
+# não abrem transação de escrita
+USER_WEEK_SEEN = LimitedCache(max_size=4096)
 
 def update_user(user_id: int):
     """Atualiza o registro de acesso semanal do usuário"""
-    with DB_LOCK:
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
+    week = calendar_keys()[1]
+    if USER_WEEK_SEEN.get(user_id) == week:
+        return
+    try:
+        with db_conn() as conn:
             c = conn.cursor()
-            week = time.strftime("%Y-W%W")
+            c.execute("BEGIN IMMEDIATE")
             c.execute("SELECT last_month FROM monthly_users WHERE user_id=?", (user_id,))
             row = c.fetchone()
             if row:
@@ -1234,70 +1953,110 @@ def update_user(user_id: int):
             else:
                 c.execute("INSERT INTO monthly_users (user_id, last_month) VALUES (?, ?)", (user_id, week))
             conn.commit()
-            conn.close()
-        except sqlite3.Error as e:
-            LOG.error("Erro ao atualizar usuário: %s", e)
+        USER_WEEK_SEEN.set(user_id, week)
+    except sqlite3.Error as e:
+        LOG.error("Erro ao atualizar usuário: %s", e)
 
-def get_user_download_stats(user_id: int) -> dict:
+def get_user_download_stats(user_id: int, _retry: bool = True) -> dict:
     """Retorna estatísticas de downloads do usuário"""
-    with DB_LOCK:
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
-            c = conn.cursor()
-            
-            # Busca ou cria registro do usuário
-            c.execute("SELECT downloads_count, is_premium, last_reset, premium_expires FROM user_downloads WHERE user_id=?", (user_id,))
-            row = c.fetchone()
-            
-            # Calcula semana atual (usando ISO week)
-            current_week = time.strftime("%Y-W%W")
-            today = time.strftime("%Y-%m-%d")
-            
-            if row:
-                downloads_count, is_premium, last_reset, premium_expires = row
-                
-                # ✅ VERIFICA SE PREMIUM EXPIROU
-                if is_premium and premium_expires:
-                    if today > premium_expires:
-                        # Premium expirou! Volta para plano gratuito
-                        LOG.info("🔔 Premium expirou para usuário %d (expirou em %s)", user_id, premium_expires)
-                        is_premium = 0
-                        downloads_count = 0  # Reseta contador
-                        c.execute("""
+    cached = USER_STATS_CACHE.get(user_id)
+    if cached and time.time() - cached[1] < USER_STATS_CACHE_TTL:
+        return dict(cached[0])
+    
+    try:
+        # Caso comum só lê: usa o pool de leitura e pega o escritor apenas
+        # quando o registro precisa mudar (expiração, nova semana, novo usuário)
+        with db_reader() as conn:
+            row = conn.execute(
+                "SELECT downloads_count, is_premium, last_reset, premium_expires FROM user_downloads WHERE user_id=?",
+                (user_id,),
+            ).fetchone()
+        
+        # Calcula semana atual (usando ISO week)
+        today, current_week = calendar_keys()
+        
+        if row:
+            downloads_count, is_premium, last_reset, premium_expires = row
+        
+            # ✅ VERIFICA SE PREMIUM EXPIROU
+            if is_premium and premium_expires:
+                if today > premium_expires:
+                    # Premium expirou! Volta para plano gratuito
+                    LOG.info("🔔 Premium expirou para usuário %d (expirou em %s)", user_id, premium_expires)
+                    is_premium = 0
+                    downloads_count = 0  # Reseta contador
+                    # Leitura e escrita usam conexões diferentes: o WHERE repete o
+                    # que foi lido para não desfazer uma renovação feita no meio
+                    with db_conn() as conn:
+                        updated = conn.execute("""
                             UPDATE user_downloads 
                             SET is_premium=0, downloads_count=0, last_reset=? 
-                            WHERE user_id=?
-                        """, (current_week, user_id))
+                            WHERE user_id=? AND is_premium=1 AND premium_expires=?
+                        """, (current_week, user_id, premium_expires)).rowcount
                         conn.commit()
-                
-                # Reseta contador se mudou a semana (apenas para plano gratuito)
-                elif last_reset != current_week and not is_premium:
-                    downloads_count = 0
-                    c.execute("UPDATE user_downloads SET downloads_count=0, last_reset=? WHERE user_id=?", 
-                             (current_week, user_id))
+                    if not updated and _retry:
+                        # Registro mudou desde a leitura (ex: premium renovado): relê
+                        return get_user_download_stats(user_id, _retry=False)
+        
+            # Reseta contador se mudou a semana (apenas para plano gratuito)
+            elif last_reset != current_week and not is_premium:
+                downloads_count = 0
+                with db_conn() as conn:
+                    updated = conn.execute(
+                        "UPDATE user_downloads SET downloads_count=0, last_reset=? "
+                        "WHERE user_id=? AND is_premium=0 AND last_reset IS ?",
+                        (current_week, user_id, last_reset),
+                    ).rowcount
                     conn.commit()
-            else:
-                # Cria novo registro
-                downloads_count, is_premium = 0, 0
-                c.execute("""
-                    INSERT INTO user_downloads (user_id, downloads_count, is_premium, last_reset) 
+                if not updated and _retry:
+                    return get_user_download_stats(user_id, _retry=False)
+        else:
+            # Cria novo registro
+            downloads_count, is_premium = 0, 0
+            with db_conn() as conn:
+                conn.execute("""
+                    INSERT OR IGNORE INTO user_downloads (user_id, downloads_count, is_premium, last_reset) 
                     VALUES (?, 0, 0, ?)
                 """, (user_id, current_week))
                 conn.commit()
-            
-            conn.close()
-            
-            remaining = "Ilimitado" if is_premium else max(0, FREE_DOWNLOADS_LIMIT - downloads_count)
-            
-            return {
-                "downloads_count": downloads_count,
-                "is_premium": bool(is_premium),
-                "remaining": remaining,
-                "limit": FREE_DOWNLOADS_LIMIT
-            }
-        except sqlite3.Error as e:
-            LOG.error("Erro ao obter estatísticas de download: %s", e)
-            return {"downloads_count": 0, "is_premium": False, "remaining": FREE_DOWNLOADS_LIMIT, "limit": FREE_DOWNLOADS_LIMIT}
+        
+        PREMIUM_CACHE.set(user_id, (bool(is_premium), time.time()))
+        remaining = "Ilimitado" if is_premium else max(0, FREE_DOWNLOADS_LIMIT - downloads_count)
+        
+        stats = {
+            "downloads_count": downloads_count,
+            "is_premium": bool(is_premium),
+            "remaining": remaining,
+            "limit": FREE_DOWNLOADS_LIMIT
+        }
+        USER_STATS_CACHE.set(user_id, (stats, time.time()))
+        return dict(stats)
+    except sqlite3.Error as e:
+        LOG.error("Erro ao obter estatísticas de download: %s", e)
+        return {"downloads_count": 0, "is_premium": False, "remaining": FREE_DOWNLOADS_LIMIT, "limit": FREE_DOWNLOADS_LIMIT}
+
+# Cache curto do status premium: muda no máximo uma vez por mês por usuário,
+# então verificações que só precisam do plano evitam ir ao SQLite
+PREMIUM_CACHE_TTL = 60
+PREMIUM_CACHE = LimitedCache(max_size=1000)
+
+# Cache das estatísticas por usuário (plano + contador): o caminho de cada
+# mensagem não vai ao SQLite; invalidado em toda escrita do usuário
+USER_STATS_CACHE_TTL = 60
+USER_STATS_CACHE = LimitedCache(max_size=4096)
+
+def invalidate_user_cache(user_id: int):
+    """Descarta os dados em cache do usuário após uma escrita"""
+    PREMIUM_CACHE.pop(user_id, None)
+    USER_STATS_CACHE.pop(user_id, None)
+
+def is_premium_cached(user_id: int) -> bool:
+    """Retorna se o usuário é premium, usando o cache quando recente"""
+    cached = PREMIUM_CACHE.get(user_id)
+    if cached and time.time() - cached[1] < PREMIUM_CACHE_TTL:
+        return cached[0]
+    # get_user_download_stats atualiza PREMIUM_CACHE
+    return get_user_download_stats(user_id)["is_premium"]
 
 def can_download(user_id: int) -> bool:
     """Verifica se o usuário pode realizar um download"""
@@ -1310,106 +2069,126 @@ def can_download(user_id: int) -> bool:
 
 def increment_download_count(user_id: int):
     """Incrementa o contador de downloads do usuário"""
-    with DB_LOCK:
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
+    try:
+        with db_conn() as conn:
             c = conn.cursor()
             c.execute("UPDATE user_downloads SET downloads_count = downloads_count + 1 WHERE user_id=?", (user_id,))
             conn.commit()
-            conn.close()
-            LOG.info("Contador de downloads incrementado para usuário %d", user_id)
-        except sqlite3.Error as e:
-            LOG.error("Erro ao incrementar contador de downloads: %s", e)
+        invalidate_user_cache(user_id)
+        LOG.info("Contador de downloads incrementado para usuário %d", user_id)
+    except sqlite3.Error as e:
+        LOG.error("Erro ao incrementar contador de downloads: %s", e)
 
 def get_monthly_users_count() -> int:
     """Retorna o número de usuários ativos na semana atual"""
-    week = time.strftime("%Y-W%W")
-    with DB_LOCK:
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
+    week = calendar_keys()[1]
+    try:
+        with db_reader() as conn:
             c = conn.cursor()
             c.execute("SELECT COUNT(*) FROM monthly_users WHERE last_month=?", (week,))
             count = c.fetchone()[0]
-            conn.close()
-            return count
-        except sqlite3.Error:
-            return 0
+        return count
+    except sqlite3.Error:
+        return 0
 
 # ============================
 # PIX PAYMENT SYSTEM (Estrutura para implementação futura)
 # ============================
 
-def create_pix_payment(user_id: int, amount: float) -> str:
+def create_pix_payment(user_id: int, amount: float, pix_key: str = None) -> str:
     """
     Cria um registro de pagamento PIX pendente
     
+    pix_key é o ID do pagamento no Mercado Pago — chave de idempotência
+    usada por confirm_pix_payment/activate_premium na confirmação.
+    
     TODO: Implementar integração com gateway de pagamento
     - Gerar QR Code PIX
-    - Criar chave PIX única por transação
     - Retornar dados para exibição ao usuário
     """
-    with DB_LOCK:
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
+    try:
+        with db_conn() as conn:
             c = conn.cursor()
-            
+        
             # Insere registro de pagamento pendente
             c.execute("""
-                INSERT INTO pix_payments (user_id, amount, status) 
-                VALUES (?, ?, 'pending')
-            """, (user_id, amount))
-            
+                INSERT INTO pix_payments (user_id, amount, pix_key, status) 
+                VALUES (?, ?, ?, 'pending')
+            """, (user_id, amount, pix_key))
+        
             payment_id = c.lastrowid
             conn.commit()
-            conn.close()
-            
-            LOG.info("Pagamento PIX criado: ID=%d, User=%d, Amount=%.2f", payment_id, user_id, amount)
-            
-            # TODO: Integrar com API de pagamento PIX
-            # Exemplo: Mercado Pago, PagSeguro, etc.
-            
-            return f"PIX_{payment_id}_{user_id}"
-        except sqlite3.Error as e:
-            LOG.error("Erro ao criar pagamento PIX: %s", e)
-            return None
+        
+        LOG.info("Pagamento PIX criado: ID=%d, User=%d, Amount=%.2f", payment_id, user_id, amount)
+        
+        # TODO: Integrar com API de pagamento PIX
+        # Exemplo: Mercado Pago, PagSeguro, etc.
+        
+        return f"PIX_{payment_id}_{user_id}"
+    except sqlite3.Error as e:
+        LOG.error("Erro ao criar pagamento PIX: %s", e)
+        return None
 
-def confirm_pix_payment(payment_reference: str, user_id: int):
+def confirm_pix_payment(pix_key, user_id: int):
     """
     Confirma um pagamento PIX e ativa o plano premium
     
-    TODO: Implementar verificação automática de pagamento
-    - Webhook do gateway de pagamento
-    - Validação do comprovante
-    - Ativação automática do premium
+    pix_key é o ID do pagamento no Mercado Pago. Só concede o premium se
+    esta chamada mudou um registro 'pending' para 'confirmed'; retorna a
+    nova data de expiração nesse caso e None caso contrário (pagamento já
+    confirmado, desconhecido ou de outro usuário). Erros de banco propagam.
     """
-    with DB_LOCK:
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
-            c = conn.cursor()
-            
-            # Atualiza status do pagamento
-            c.execute("""
-                UPDATE pix_payments 
-                SET status='confirmed', confirmed_at=CURRENT_TIMESTAMP 
-                WHERE user_id=? AND status='pending'
-            """, (user_id,))
-            
-            # Ativa premium para o usuário
-            premium_expires = time.strftime("%Y-%m-%d", time.localtime(time.time() + 30*24*60*60))  # +30 dias
-            c.execute("""
-                UPDATE user_downloads 
-                SET is_premium=1, premium_expires=? 
-                WHERE user_id=?
-            """, (premium_expires, user_id))
-            
-            conn.commit()
-            conn.close()
-            
-            LOG.info("Pagamento PIX confirmado para usuário %d", user_id)
-            return True
-        except sqlite3.Error as e:
-            LOG.error("Erro ao confirmar pagamento PIX: %s", e)
-            return False
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+    
+        # Atualiza status do pagamento (só se ainda pendente)
+        c.execute("""
+            UPDATE pix_payments 
+            SET status='confirmed', confirmed_at=CURRENT_TIMESTAMP 
+            WHERE pix_key=? AND user_id=? AND status='pending'
+        """, (str(pix_key), user_id))
+        
+        # Idempotência: nada mudou = nada a conceder (notificação repetida
+        # de pagamento já confirmado, ou pagamento sem registro pendente)
+        if c.rowcount == 0:
+            already_confirmed = c.execute(
+                "SELECT 1 FROM pix_payments WHERE pix_key=? AND status='confirmed'",
+                (str(pix_key),)
+            ).fetchone()
+            conn.rollback()
+            if already_confirmed:
+                LOG.info("Pagamento %s já confirmado anteriormente - ignorando", pix_key)
+            else:
+                LOG.warning("Pagamento %s sem registro pendente para usuário %d - premium não concedido",
+                            pix_key, user_id)
+            return None
+    
+        # Ativa premium para o usuário
+        premium_expires = (datetime.now() + timedelta(days=PREMIUM_DURATION_DAYS)).strftime("%Y-%m-%d")
+        c.execute("""
+            UPDATE user_downloads 
+            SET is_premium=1, premium_expires=? 
+            WHERE user_id=?
+        """, (premium_expires, user_id))
+    
+        conn.commit()
+    invalidate_user_cache(user_id)
+    
+    LOG.info("Pagamento PIX %s confirmado para usuário %d", pix_key, user_id)
+    return premium_expires
+
+def find_pix_payment_user(pix_key):
+    """Retorna o user_id dono do pagamento PIX (pix_key = ID no Mercado Pago)"""
+    try:
+        with db_reader() as conn:
+            row = conn.execute(
+                "SELECT user_id FROM pix_payments WHERE pix_key=?", (str(pix_key),)
+            ).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        LOG.error("Erro ao buscar pagamento PIX %s: %s", pix_key, e)
+        return None
 
 # Inicializar banco de dados
 init_db()
@@ -1461,17 +2240,17 @@ def is_valid_url(url: str) -> bool:
 
 def get_cookie_for_url(url: str):
     """Retorna o arquivo de cookie apropriado baseado na URL"""
-    url_lower = url.lower()
+    kind = url_kind(url)
     
-    if 'shopee' in url_lower:
+    if kind in SHOPEE_URL_KINDS:
         if COOKIE_SHOPEE:
             LOG.info("Usando cookies da Shopee")
             return COOKIE_SHOPEE
-    elif 'instagram' in url_lower or 'insta' in url_lower:
+    elif kind == "instagram":
         if COOKIE_IG:
             LOG.info("Usando cookies do Instagram")
             return COOKIE_IG
-    elif 'youtube' in url_lower or 'youtu.be' in url_lower:
+    elif kind == "youtube":
         if COOKIE_YT:
             LOG.info("Usando cookies do YouTube")
             return COOKIE_YT
@@ -1534,20 +2313,20 @@ def get_format_for_url(url: str, quality: str = None) -> str:
         quality: Qualidade para YouTube (360p, 480p, 720p, 1080p, best).
                  Se None, usa padrão (720p para YouTube)
     """
-    url_lower = url.lower()
+    kind = url_kind(url)
 
     # Shopee: melhor qualidade disponível (geralmente já é pequeno)
-    if 'shopee' in url_lower or 'shope.ee' in url_lower:
+    if kind in SHOPEE_URL_KINDS:
         LOG.info("🛍️ Formato Shopee: best (otimizado)")
         return "best[filesize<50M]/best"
 
     # Instagram: formato único já otimizado
-    elif 'instagram' in url_lower or 'insta' in url_lower:
+    elif kind == "instagram":
         LOG.info("📸 Formato Instagram: best (otimizado)")
         return "best"
 
     # YouTube: permite escolha de qualidade
-    elif 'youtube' in url_lower or 'youtu.be' in url_lower:
+    elif kind == "youtube":
         if quality:
             LOG.info("🎥 Formato YouTube: %s (escolhido pelo usuário)", quality)
             return get_youtube_format_by_quality(quality)
@@ -1610,14 +2389,8 @@ def expand_short_url(url: str) -> str:
         
         LOG.info("🔗 Expandindo link encurtado: %s", url[:50])
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'pt-BR,pt;q=0.9,en;q=0.8',
-        }
-        
         # Tenta seguir redirects
-        response = requests.get(url, headers=headers, allow_redirects=True, timeout=10)
+        response = requests.get(url, headers=SHORT_URL_HEADERS, allow_redirects=True, timeout=10)
         
         if response.url != url:
             LOG.info("✅ Link expandido: %s", response.url[:80])
@@ -1641,30 +2414,15 @@ def extract_shopee_video_direct(url: str) -> dict:
     """
     try:
         import requests
-        import re
-        import json
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Referer': 'https://shopee.com.br/',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        }
         
         LOG.info("🛍️ Tentando extração direta da Shopee...")
-        response = requests.get(url, headers=headers, timeout=10)
+        response = requests.get(url, headers=SHOPEE_DIRECT_HEADERS, timeout=10)
         html = response.text
         
         # Procura por URLs de vídeo no HTML/JavaScript
-        video_patterns = [
-            r'"video_url"\s*:\s*"([^"]+)"',
-            r'"url"\s*:\s*"(https://[^"]*\.mp4[^"]*)"',
-            r'https://cf\.shopee\.com\.br/file/[a-zA-Z0-9]+',
-            r'https://[^"\']*shopee[^"\']*\.mp4[^"\']*',
-        ]
-        
         video_url = None
-        for pattern in video_patterns:
-            matches = re.findall(pattern, html)
+        for pattern in SHOPEE_DIRECT_VIDEO_PATTERNS:
+            matches = pattern.findall(html)
             if matches:
                 video_url = matches[0].replace('\\/', '/')
                 LOG.info("✅ URL de vídeo encontrada: %s", video_url[:80])
@@ -1733,13 +2491,13 @@ def ffmpeg_compress_video(input_path: str, output_path: str, target_size_mb: int
         result = subprocess.run(duration_cmd, capture_output=True, text=True, timeout=30)
         duration = float(result.stdout.strip())
         
-        LOG.info(f"📊 Vídeo Shopee: {duration:.1f}s")
+        LOG.info("📊 Vídeo Shopee: %.1fs", duration)
         
         # Calcular bitrate necessário
         target_bitrate = int((target_size_mb * 8 * 1000) / duration)
         target_bitrate = max(target_bitrate, 400)  # Mínimo 400k
         
-        LOG.info(f"🎬 Comprimindo com bitrate {target_bitrate}k...")
+        LOG.info("🎬 Comprimindo com bitrate %sk...", target_bitrate)
         
         # Comando de compressão
         cmd = [
@@ -1756,27 +2514,36 @@ def ffmpeg_compress_video(input_path: str, output_path: str, target_size_mb: int
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
         
         if result.returncode != 0:
-            LOG.error(f"FFmpeg error: {result.stderr[:200]}")
+            LOG.error("FFmpeg error: %s", result.stderr[:200])
             return False
         
         compressed_size = os.path.getsize(output_path)
         original_size = os.path.getsize(input_path)
         
-        LOG.info(f"✅ Compressão OK: {original_size/(1024*1024):.1f}MB → {compressed_size/(1024*1024):.1f}MB")
+        LOG.info("✅ Compressão OK: %.1fMB → %.1fMB", original_size/(1024*1024), compressed_size/(1024*1024))
         
         return compressed_size <= TELEGRAM_VIDEO_SIZE_LIMIT
     
     except Exception as e:
-        LOG.error(f"❌ Erro ao comprimir: {e}")
+        LOG.error("❌ Erro ao comprimir: %s", e)
         return False
 
+def streamed_video(fh, path: str) -> InputFile:
+    """Embrulha o arquivo aberto para upload em streaming (httpx lê em blocos).
+
+    Passar o handle direto faz o python-telegram-bot ler o vídeo inteiro para
+    a memória antes do multipart; com read_file_handle=False o pico de RSS do
+    upload não depende mais do tamanho do arquivo.
+    """
+    return InputFile(fh, filename=os.path.basename(path), read_file_handle=False)
+
 async def safe_send_video_telegram(bot, chat_id, video_path, caption, pm, tmpdir):
     """Envia vídeo com validação de tamanho e compressão automática"""
     try:
         file_size = os.path.getsize(video_path)
         file_size_mb = file_size / (1024 * 1024)
         
-        LOG.info(f"📊 Arquivo a enviar: {file_size_mb:.1f}MB")
+        LOG.info("📊 Arquivo a enviar: %.1fMB", file_size_mb)
         
         # Se está dentro do limite, envia direto
         if file_size <= TELEGRAM_VIDEO_SIZE_LIMIT:
@@ -1790,11 +2557,11 @@ async def safe_send_video_telegram(bot, chat_id, video_path, caption, pm, tmpdir
                 try:
                     fh.seek(0)
 
-                    LOG.info(f"📤 Tentando enviar vídeo (tentativa {attempt + 1}/{MAX_RETRIES})...")
+                    LOG.info("📤 Tentando enviar vídeo (tentativa %s/%s)...", attempt + 1, MAX_RETRIES)
 
                     await bot.send_video(
                         chat_id=chat_id,
-                        video=fh,
+                        video=streamed_video(fh, video_path),
                         caption=caption
                     )
 
@@ -1804,11 +2571,11 @@ async def safe_send_video_telegram(bot, chat_id, video_path, caption, pm, tmpdir
 
                 except TimedOut:
                     fh.close()
-                    LOG.warning(f"⚠️ Timeout ao enviar vídeo (tentativa {attempt + 1})")
+                    LOG.warning("⚠️ Timeout ao enviar vídeo (tentativa %s)", attempt + 1)
 
                     if attempt + 1 < MAX_RETRIES:
                         delay = retry_delay[attempt]
-                        LOG.info(f"⏳ Aguardando {delay}s antes da nova tentativa...")
+                        LOG.info("⏳ Aguardando %ss antes da nova tentativa...", delay)
                         await asyncio.sleep(delay)
                         continue
 
@@ -1817,11 +2584,11 @@ async def safe_send_video_telegram(bot, chat_id, video_path, caption, pm, tmpdir
 
                 except Exception as e:
                     fh.close()
-                    LOG.error(f"❌ Erro inesperado ao enviar vídeo: {e}")
+                    LOG.error("❌ Erro inesperado ao enviar vídeo: %s", e)
                     return False
         
         # Arquivo excede limite
-        LOG.warning(f"⚠️ Arquivo excede 50MB! Tentando comprimir...")
+        LOG.warning("⚠️ Arquivo excede 50MB! Tentando comprimir...")
         
         # Atualizar mensagem
         if pm:
@@ -1845,7 +2612,7 @@ async def safe_send_video_telegram(bot, chat_id, video_path, caption, pm, tmpdir
             with open(compressed_path, "rb") as fh:
                 await bot.send_video(
                     chat_id=chat_id,
-                    video=fh,
+                    video=streamed_video(fh, compressed_path),
                     caption=f"{caption}\n\n📦 Vídeo comprimido para caber no Telegram"
                 )
             
@@ -1868,7 +2635,7 @@ async def safe_send_video_telegram(bot, chat_id, video_path, caption, pm, tmpdir
             return False
     
     except Exception as e:
-        LOG.exception(f"❌ Erro ao enviar: {e}")
+        LOG.exception("❌ Erro ao enviar: %s", e)
         return False
 
 async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
@@ -1891,12 +2658,7 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
         LOG.info("Iniciando extração customizada da Shopee: %s", url)
 
         # Prepara headers e cookies para download (usados em ambos os métodos)
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Referer": "https://shopee.com.br/",
-        }
+        headers = SHOPEE_DOWNLOAD_HEADERS
         
         cookies_dict = {}
         if COOKIE_SHOPEE:
@@ -1913,7 +2675,7 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
 
         # 🎯 MÉTODO 1: Usa ShopeeVideoExtractor (API interna)
         LOG.info("🎯 Tentando método ShopeeVideoExtractor (API)...")
-        video_info = SHOPEE_EXTRACTOR.get_video(url)
+        video_info = await asyncio.to_thread(SHOPEE_EXTRACTOR.get_video, url)
         
         video_url = None
         url_already_clean = False  # Flag para saber se URL já está sem marca
@@ -1937,23 +2699,8 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
             LOG.info("Página da Shopee carregada, analisando...")
 
             # Busca URL do vídeo no HTML com múltiplos padrões
-            patterns = [
-                # Padrões comuns da Shopee
-                r'"videoUrl"\s*:\s*"([^"]+)"',
-                r'"video_url"\s*:\s*"([^"]+)"',
-                r'"playAddr"\s*:\s*"([^"]+)"',
-                r'"url"\s*:\s*"(https://[^"]*\.mp4[^"]*)"',
-                # Padrões do domínio específico
-                r'(https://down-[^"]*\.vod\.susercontent\.com[^"]*)',
-                r'(https://[^"]*susercontent\.com[^"]*\.mp4[^"]*)',
-                r'(https://cf\.shopee\.com\.br/file/[^"]+)',
-                # Padrão watermarkVideoUrl
-                r'"watermarkVideoUrl"\s*:\s*"([^"]+)"',
-                r'"defaultFormat"[^}]*"url"\s*:\s*"([^"]+)"',
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, response.text)
+            for pattern in SHOPEE_PAGE_VIDEO_PATTERNS:
+                matches = pattern.findall(response.text)
                 if matches:
                     video_url = matches[0].replace('\\/', '/')
                     LOG.info("URL de vídeo encontrada via regex: %s", video_url[:100])
@@ -2024,12 +2771,15 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
             return
 
         # Prossegue normalmente se arquivo ≤ 50MB
-        with open(output_path, 'wb') as f:
-            # OTIMIZAÇÃO #5: Chunks maiores (512KB) reduzem overhead e memória
-            for chunk in video_response.iter_content(chunk_size=524288):  # 512 KB
-                if chunk:
-                    f.write(chunk)
-                    del chunk  # Libera memória explicitamente
+        def _save_video():
+            with open(output_path, 'wb') as f:
+                # OTIMIZAÇÃO #5: Chunks maiores (512KB) reduzem overhead e memória
+                for chunk in video_response.iter_content(chunk_size=524288):  # 512 KB
+                    if chunk:
+                        f.write(chunk)
+                        del chunk  # Libera memória explicitamente
+
+        await asyncio.to_thread(_save_video)
 
         LOG.info("✅ Vídeo da Shopee baixado com sucesso: %s", output_path)
 
@@ -2048,11 +2798,11 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
             )
 
             # POSIÇÃO CORRETA: MEIO DIREITO ✅
-            cleaned_path = WATERMARK_REMOVER.remove(output_path, position='middle_right')
+            cleaned_path = await asyncio.to_thread(WATERMARK_REMOVER.remove, output_path, position='middle_right')
             if not os.path.exists(cleaned_path):
                 LOG.warning("⚠️ Falha na posição middle_right, tentando outras...")
                 for pos in ['middle_right_high', 'middle_right_low', 'middle_center', 'bottom_right']:
-                    cleaned_path = WATERMARK_REMOVER.remove(output_path, position=pos)
+                    cleaned_path = await asyncio.to_thread(WATERMARK_REMOVER.remove, output_path, position=pos)
                     if os.path.exists(cleaned_path):
                         break
 
@@ -2129,8 +2879,7 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
                         percent = int(downloaded * 100 / total_size)
                         if percent != last_percent and percent % 10 == 0:
                             last_percent = percent
-                            blocks = int(percent / 5)
-                            bar = "█" * blocks + "░" * (20 - blocks)
+                            bar = PROGRESS_BARS[min(percent, 100) // 5]
                             try:
                                 await application.bot.edit_message_text(
                                     text=f"Baixando (Shopee): {percent}%\n{bar}",
@@ -2154,7 +2903,7 @@ async def _download_shopee_video(url: str, tmpdir: str, chat_id: int, pm: dict):
         )
         
         with open(output_path, "rb") as fh:
-            await application.bot.send_video(chat_id=chat_id, video=fh, caption="Aproveite o seu vídeo.")
+            await application.bot.send_video(chat_id=chat_id, video=streamed_video(fh, output_path), caption="Aproveite o seu vídeo.")
         
         # Mensagem de sucesso com contador
         stats = get_user_download_stats(pm["user_id"])
@@ -2280,18 +3029,16 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if stats["is_premium"]:
         # Busca data de expiração
         try:
-            with DB_LOCK:
-                conn = sqlite3.connect(DB_FILE, timeout=5)
+            with db_reader() as conn:
                 c = conn.cursor()
                 c.execute("SELECT premium_expires FROM user_downloads WHERE user_id=?", (user_id,))
                 row = c.fetchone()
-                conn.close()
-                
-                if row and row[0]:
-                    expires_date = row[0]
-                    premium_info = f"Plano: <b>Premium</b>\nExpira em: <b>{expires_date}</b>"
-                else:
-                    premium_info = "Plano: <b>Premium</b>"
+            
+            if row and row[0]:
+                expires_date = row[0]
+                premium_info = f"Plano: <b>Premium</b>\nExpira em: <b>{expires_date}</b>"
+            else:
+                premium_info = "Plano: <b>Premium</b>"
         except:
             premium_info = "Plano: <b>Premium</b>"
     else:
@@ -2340,8 +3087,10 @@ async def ai_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_message = " ".join(context.args)
         await update.message.chat.send_action("typing")
         
-        response = await chat_with_ai(
+        replied = await reply_with_ai_stream(
+            update,
             user_message,
+            parse_mode="HTML",
             system_prompt=f"""Você é o assistente de suporte do bot de downloads do Telegram. Seu escopo é este bot e a busca de produtos na Shopee Brasil — nada além disso.
 
 Regras:
@@ -2364,9 +3113,7 @@ Comandos disponíveis:
 """
         )
         
-        if response:
-            await update.message.reply_text(response, parse_mode="HTML")
-        else:
+        if not replied:
             await update.message.reply_text(
                 "Erro ao processar sua mensagem. Tente novamente."
             )
@@ -2405,7 +3152,7 @@ def get_premium_monthly_stats() -> dict:
         }
     """
     try:
-        with get_db_connection() as conn:
+        with db_reader() as conn:
             c = conn.cursor()
             
             # Data atual
@@ -2504,7 +3251,7 @@ def get_premium_monthly_stats() -> dict:
             }
             
     except Exception as e:
-        LOG.error(f"Erro ao buscar estatísticas premium: {e}")
+        LOG.error("Erro ao buscar estatísticas premium: %s", e)
         return {
             'total_active': 0,
             'expires_this_month': 0,
@@ -2731,9 +3478,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     update_user(user_id)
     
-    # Verifica se é um link válido
-    urls = URL_RE.findall(text)
-    if not urls:
+    # Verifica se é um link válido (só a primeira URL importa: search em vez de findall)
+    url_match = URL_RE.search(text)
+    if url_match is None:
         # Não há URL - verifica se tem IA disponível para chat
         if groq_client:
             # Analisa intenção do usuário
@@ -2745,7 +3492,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 LOG.info("💬 Chat IA - Usuário %d: %s", user_id, text[:50])
                 await update.message.chat.send_action("typing")
                 
-                response = await chat_with_ai(
+                replied = await reply_with_ai_stream(
+                    update,
                     text,
                     system_prompt=f"""Você é o assistente de suporte do bot de downloads do Telegram. Seu escopo é este bot e a busca de produtos na Shopee Brasil — nada além disso.
 
@@ -2769,9 +3517,7 @@ Comandos disponíveis:
 """
                 )
                 
-                if response:
-                    await update.message.reply_text(response)
-                else:
+                if not replied:
                     await update.message.reply_text(
                         "⚠️ Desculpe, não consegui processar sua mensagem.\n\n"
                         "💡 <b>Dica:</b> Para baixar vídeos, envie um link!\n"
@@ -2784,7 +3530,7 @@ Comandos disponíveis:
         await update.message.reply_text(MESSAGES["url_prompt"])
         return
     
-    url = urls[0]
+    url = url_match.group(1)
     
     if not is_valid_url(url):
         await update.message.reply_text(MESSAGES["invalid_url"])
@@ -2806,7 +3552,7 @@ Comandos disponíveis:
     token = str(uuid.uuid4())
     
     # 🔗 PASSO 1: Expande links encurtados (br.shp.ee, shope.ee)
-    if 'shp.ee' in url.lower() or 'shope.ee' in url.lower():
+    if SHOPEE_SHORT_LINK_RE.search(url):
         LOG.info("🔗 Link encurtado detectado! Tentando expandir...")
         
         expanded = expand_short_url(url)
@@ -2830,7 +3576,7 @@ Comandos disponíveis:
             return
     
     # 🔗 PASSO 2: Resolve links universais da Shopee
-    if 'shopee' in url.lower():
+    if url_kind(url) in SHOPEE_URL_KINDS:
         original_url = url
         url = resolve_shopee_universal_link(url)
         if url != original_url:
@@ -2840,7 +3586,7 @@ Comandos disponíveis:
     processing_msg = await update.message.reply_text(MESSAGES["processing"])
     
     # Verifica se é Shopee Video
-    is_shopee_video = 'sv.shopee' in url.lower() or 'share-video' in url.lower()
+    is_shopee_video = url_kind(url) == "sv_shopee"
     
     if is_shopee_video:
         # Para Shopee Video, criamos confirmação simples sem informações detalhadas
@@ -2868,13 +3614,15 @@ Comandos disponíveis:
         )
         
         # Armazena informações pendentes
+        now = time.time()
         PENDING.set(token, {
             "url": url,
             "user_id": user_id,
             "chat_id": update.effective_chat.id,
             "message_id": processing_msg.message_id,
-            "timestamp": time.time(),
+            "timestamp": now,
         })
+        heapq.heappush(PENDING_EXPIRY_HEAP, (now + PENDING_EXPIRE_SECONDS, token))
         
         # Remove requisições antigas
         _cleanup_pending()
@@ -2900,7 +3648,7 @@ Comandos disponíveis:
             return
 
         # Detecta se é YouTube para mostrar seleção de qualidade
-        is_youtube = 'youtube' in url.lower() or 'youtu.be' in url.lower()
+        is_youtube = url_kind(url) == "youtube"
 
         if is_youtube:
             # Para YouTube: mostra botões de seleção de qualidade
@@ -2953,13 +3701,20 @@ Comandos disponíveis:
         )
 
         # Armazena informações pendentes
+        now = time.time()
         PENDING.set(token, {
             "url": url,
             "user_id": user_id,
             "chat_id": update.effective_chat.id,
             "message_id": processing_msg.message_id,
-            "timestamp": time.time(),
+            "timestamp": now,
+            "filesize": filesize_bytes,
         })
+        # Extração reaproveitada no download (só as PENDING_INFO_MAX mais recentes)
+        ydl_info = reusable_ydl_info(video_info)
+        if ydl_info is not None:
+            PENDING_INFO.set(token, ydl_info)
+        heapq.heappush(PENDING_EXPIRY_HEAP, (now + PENDING_EXPIRE_SECONDS, token))
         
         # Remove requisições antigas
         _cleanup_pending()
@@ -2968,12 +3723,70 @@ Comandos disponíveis:
         LOG.exception("Erro ao obter informações do vídeo: %s", e)
         await processing_msg.edit_text(MESSAGES["error_unknown"])
 
+# Chaves grandes que o download não usa (legendas automáticas chegam a MBs)
+YDL_INFO_DROP_KEYS = frozenset({"automatic_captions", "subtitles", "requested_subtitles", "thumbnails", "heatmap"})
+
+def reusable_ydl_info(info: dict):
+    """Versão enxuta do info do yt-dlp para reaproveitar no download (ou None)"""
+    # Só dicts vindos do yt-dlp (a API da Shopee devolve um formato próprio)
+    if not info or "extractor" not in info or ("formats" not in info and "url" not in info):
+        return None
+    return {k: v for k, v in info.items() if k not in YDL_INFO_DROP_KEYS}
+
+async def extract_info_in_pool(url: str, ydl_opts: dict) -> dict:
+    """Extrai informações do vídeo no pool de processos"""
+    loop = asyncio.get_running_loop()
+    pool = get_ydl_process_pool()
+    if pool is None:
+        return await asyncio.to_thread(_extract_info_direct, url, ydl_opts)
+    try:
+        return await loop.run_in_executor(pool, _extract_info_worker, url, ydl_opts)
+    except BrokenProcessPool:
+        LOG.warning("⚠️ Pool de processos do yt-dlp quebrado - extrações seguem em thread")
+        _reset_ydl_process_pool()
+        raise
+
+async def _race_shopee_extraction(url: str, ydl_opts: dict):
+    """
+    Requisição especulativa para Shopee: yt-dlp e extração direta rodam em
+    paralelo; vence o primeiro resultado válido e o outro é cancelado.
+    
+    Returns:
+        tuple: (info ou None, último erro ou None)
+    """
+    tasks = {
+        asyncio.create_task(extract_info_in_pool(url, ydl_opts)): "yt-dlp",
+        asyncio.create_task(asyncio.to_thread(extract_shopee_video_direct, url)): "extração direta",
+    }
+    pending = set(tasks)
+    last_error = None
+    
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if result:
+                    LOG.info("✅ Shopee extraída via %s", tasks[task])
+                    return result, None
+    finally:
+        # O trabalho já iniciado na thread/processo não é interrompido,
+        # apenas o resultado perdedor é descartado
+        for task in pending:
+            task.cancel()
+    
+    return None, last_error
+
 async def get_video_info(url: str) -> dict:
     """Obtém informações básicas do vídeo sem fazer download"""
     cookie_file = get_cookie_for_url(url)
     
     # Configuração especial para Shopee
-    is_shopee = 'shopee' in url.lower() or 'shope.ee' in url.lower()
+    is_shopee = url_kind(url) in SHOPEE_URL_KINDS
     
     # 🔗 CRÍTICO: Resolve universal-links ANTES de tudo!
     if is_shopee and 'universal-link' in url:
@@ -2981,7 +3794,7 @@ async def get_video_info(url: str) -> dict:
         url = resolve_shopee_universal_link(url)
         LOG.info("🔗 Universal link resolvido: %s", url[:80])
         # Atualiza flag is_shopee após resolver
-        is_shopee = 'shopee' in url.lower() or 'shope.ee' in url.lower()
+        is_shopee = url_kind(url) in SHOPEE_URL_KINDS
     
     # 🎯 NOVO: Se for Shopee, tenta API primeiro (SEM marca d'água!)
     if is_shopee:
@@ -3000,52 +3813,15 @@ async def get_video_info(url: str) -> dict:
         else:
             LOG.warning("⚠️ API Shopee falhou, tentando yt-dlp...")
     
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        "extract_flat": False,
-        "no_check_certificate": True,
-        "prefer_insecure": True,
-        # OTIMIZAÇÃO #3: Reduz uso de memória do yt-dlp (50-70% menos RAM)
-        "no_cache_dir": True,  # Desabilita cache em disco
-        "extractor_retries": 4,  # Aumentado para melhor resiliência
-        "fragment_retries": 4,   # Aumentado para melhor resiliência
-        "buffersize": 1024 * 64,  # 64KB buffer (padrão: 1024KB)
-        # Adiciona formato otimizado para yt-dlp 2025.11.12+
-        "format": "bestvideo+bestaudio/best/bestvideo/bestaudio",
-        "ignore_no_formats_error": True,
-        # 🔧 FIX CONEXÃO YOUTUBE: Aumenta timeouts e retries para evitar "Connection refused"
-        "socket_timeout": 60,  # 60s timeout (aumentado de 30s)
-        "http_chunk_size": 262144,  # 256KB chunks (mais estável)
-        "retries": 25,  # ✅ CORRIGIDO: Número simples (não dicionário)
-        "skip_unavailable_fragments": True,  # Evita falhar com fragmentos indisponíveis
-        "force_ipv4": True,  # Força IPv4 (mais estável)
-        # Headers padrão para evitar bloqueios
-        "http_headers": {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
-        },
-    }
+    ydl_opts = dict(YDL_INFO_OPTS)
     
     if is_shopee:
         # Configurações específicas para Shopee
-        ydl_opts.update({
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
-                "Referer": "https://shopee.com.br/",
-                "Origin": "https://shopee.com.br",
-            },
-            "socket_timeout": 60,
-            "retries": 25,  # ✅ CORRIGIDO: Número simples
-        })
+        ydl_opts.update(SHOPEE_YDL_INFO_OPTS)
         LOG.info("🛍️ Configurações especiais para Shopee aplicadas")
     
     if cookie_file:
         ydl_opts["cookiefile"] = cookie_file
-    
-    ydl_opts.pop("format", None)
 
     # Retentativa com backoff: extractors como o do TikTok falham de forma
     # intermitente (challenge anti-bot) mesmo com extractor_retries interno
@@ -3053,12 +3829,22 @@ async def get_video_info(url: str) -> dict:
     # de rede retryable. Tentamos algumas vezes antes de desistir.
     max_attempts = 3
     last_error = None
+    first_attempt = 1
+
+    # Shopee: a 1ª tentativa do yt-dlp corre em paralelo com a extração
+    # direta (que costuma vencer) em vez de só rodar após todos os retries
+    if is_shopee:
+        info, last_error = await _race_shopee_extraction(url, ydl_opts)
+        if info:
+            return info
+        LOG.warning("Tentativa 1/%d falhou ao extrair informações (%s): %s",
+                    max_attempts, url[:60], last_error)
+        await asyncio.sleep(2)
+        first_attempt = 2
 
-    for attempt in range(1, max_attempts + 1):
+    for attempt in range(first_attempt, max_attempts + 1):
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-                return info
+            return await extract_info_in_pool(url, ydl_opts)
         except Exception as e:
             last_error = e
             LOG.warning("Tentativa %d/%d falhou ao extrair informações (%s): %s",
@@ -3068,27 +3854,27 @@ async def get_video_info(url: str) -> dict:
 
     LOG.error("Erro ao extrair informações com yt-dlp após %d tentativas: %s", max_attempts, last_error)
 
-    # Se for Shopee e yt-dlp falhou, tenta extração direta
-    if is_shopee:
-        LOG.info("🛍️ Tentando extração direta da Shopee como fallback...")
-        direct_info = extract_shopee_video_direct(url)
-        if direct_info:
-            LOG.info("✅ Extração direta bem-sucedida!")
-            return direct_info
-
     return None
 
 # ====================================================================
 # FUNÇÕES DE INTELIGÊNCIA ARTIFICIAL (GROQ)
 # ====================================================================
 
-async def chat_with_ai(message: str, system_prompt: str = None) -> str:
+def _select_groq_model(message: str, system_prompt: str = None) -> str:
+    """Escolhe o modelo pelo tamanho total do prompt"""
+    prompt_chars = len(message) + len(system_prompt or "")
+    return GROQ_FAST_MODEL if prompt_chars < GROQ_FAST_PROMPT_CHARS else GROQ_MODEL
+
+async def chat_with_ai(message: str, system_prompt: str = None,
+                       max_tokens: int = 1024, temperature: float = 0.7) -> str:
     """
     Envia mensagem para Groq AI e retorna resposta.
     
     Args:
         message: Mensagem do usuário
         system_prompt: Instruções do sistema (opcional)
+        max_tokens: Limite de tokens da resposta
+        temperature: Temperatura de amostragem
         
     Returns:
         str: Resposta da IA
@@ -3112,12 +3898,13 @@ async def chat_with_ai(message: str, system_prompt: str = None) -> str:
             "content": message
         })
         
-        # Chama API do Groq
-        response = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
+        # Chama API do Groq (cliente síncrono: em thread, fora do event loop)
+        response = await asyncio.to_thread(
+            groq_client.chat.completions.create,
+            model=_select_groq_model(message, system_prompt),
             messages=messages,
-            temperature=0.7,
-            max_tokens=1024
+            temperature=temperature,
+            max_tokens=max_tokens
         )
         
         return response.choices[0].message.content
@@ -3127,10 +3914,170 @@ async def chat_with_ai(message: str, system_prompt: str = None) -> str:
         return None
 
 
+async def chat_with_ai_stream(message: str, system_prompt: str = None,
+                              max_tokens: int = 1024, temperature: float = 0.7):
+    """
+    Versão em streaming de chat_with_ai: gera os trechos da resposta à
+    medida que o Groq os envia (primeiro token em ~150ms em vez de ~1.5s).
+    
+    Args:
+        message: Mensagem do usuário
+        system_prompt: Instruções do sistema (opcional)
+        max_tokens: Limite de tokens da resposta
+        temperature: Temperatura de amostragem
+        
+    Yields:
+        str: Trechos parciais da resposta
+    """
+    if not groq_client:
+        return
+    
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": message})
+    
+    try:
+        # O cliente do Groq é síncrono: abertura do stream e leitura de cada
+        # trecho rodam em thread para não travar o event loop
+        stream = await asyncio.to_thread(
+            groq_client.chat.completions.create,
+            model=_select_groq_model(message, system_prompt),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        chunks = iter(stream)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        LOG.error("Erro no streaming do Groq AI: %s", e)
+
+
+# Intervalo mínimo entre edições da mensagem durante o streaming
+# (o Telegram limita edições a ~1 por segundo por chat)
+AI_STREAM_EDIT_INTERVAL = 1.0
+
+async def reply_with_ai_stream(update: Update, message: str, system_prompt: str = None,
+                               parse_mode: str = None) -> bool:
+    """
+    Responde ao usuário com a resposta da IA em streaming, editando a
+    mensagem conforme os trechos chegam.
+    
+    Returns:
+        bool: True se alguma resposta foi enviada
+    """
+    sent = None
+    text = ""
+    shown = ""
+    last_edit = 0.0
+    
+    async for piece in chat_with_ai_stream(message, system_prompt=system_prompt):
+        text += piece
+        now = time.monotonic()
+        if sent is None:
+            sent = await update.message.reply_text(text)
+            shown, last_edit = text, now
+        elif now - last_edit >= AI_STREAM_EDIT_INTERVAL:
+            # Parciais vão sem parse_mode: HTML incompleto seria rejeitado
+            try:
+                await sent.edit_text(text)
+                shown = text
+            except Exception as e:
+                LOG.debug("Erro ao atualizar resposta parcial: %s", type(e).__name__)
+            last_edit = now
+    
+    if sent is None:
+        return False
+    
+    # Edição final com a resposta completa (e formatação, se pedida)
+    if parse_mode or text != shown:
+        try:
+            await sent.edit_text(text, parse_mode=parse_mode)
+        except Exception as e:
+            LOG.debug("Erro na edição final da resposta: %s", type(e).__name__)
+            if text != shown:
+                try:
+                    await sent.edit_text(text)
+                except Exception as e:
+                    LOG.error("Erro ao enviar resposta da IA: %s", e)
+    return True
+
+
+# Limite da descrição enviada ao Groq, em bytes UTF-8 (emojis/acentos ocupam
+# vários bytes e vários tokens — limitar por caracteres não limita o custo)
+SUMMARY_DESCRIPTION_MAX_BYTES = 600
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Corta o texto em no máximo max_bytes (UTF-8) sem quebrar caracteres"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', errors='ignore') + "..."
+
+# Mensagens de sistema fixas, montadas uma única vez
+_SUMMARY_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "Você é um assistente que resume vídeos de forma clara e concisa."
+}
+_INTENT_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "Você analisa intenções de usuários. Responda apenas: download, help ou chat."
+}
+
+# Cache de resumos por vídeo: o mesmo link compartilhado duas vezes não
+# paga de novo o round-trip ao Groq (memória → SQLite → IA)
+SUMMARY_CACHE_TTL = 86400  # 24 horas
+SUMMARY_CACHE = LimitedCache(max_size=500)
+
+def get_cached_summary(video_id: str):
+    """Retorna o resumo em cache para o vídeo, ou None se ausente/expirado"""
+    now = time.time()
+    
+    cached = SUMMARY_CACHE.get(video_id)
+    if cached and now - cached[1] < SUMMARY_CACHE_TTL:
+        return cached[0]
+    
+    try:
+        with db_reader() as conn:
+            row = conn.execute(
+                "SELECT summary, created_at FROM video_summaries WHERE video_id=? AND created_at>=?",
+                (video_id, int(now - SUMMARY_CACHE_TTL))
+            ).fetchone()
+    except Exception as e:
+        LOG.debug("Erro ao ler cache de resumo: %s", e)
+        return None
+    
+    if row:
+        SUMMARY_CACHE.set(video_id, (row[0], row[1]))
+        return row[0]
+    return None
+
+def save_cached_summary(video_id: str, summary: str):
+    """Armazena o resumo do vídeo na memória e no SQLite"""
+    now = int(time.time())
+    SUMMARY_CACHE.set(video_id, (summary, now))
+    try:
+        with get_db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO video_summaries (video_id, summary, created_at) VALUES (?, ?, ?)",
+                (video_id, summary, now)
+            )
+    except Exception as e:
+        LOG.debug("Erro ao gravar cache de resumo: %s", e)
+
+
 async def generate_video_summary(video_info: dict) -> str:
     """
     Gera resumo inteligente de um vídeo usando IA.
     
+    Resumos ficam em cache por ID do vídeo (ou URL, se não houver ID).
+    
     Args:
         video_info: Dicionário com informações do vídeo
         
@@ -3140,13 +4087,20 @@ async def generate_video_summary(video_info: dict) -> str:
     if not groq_client:
         return ""
     
+    video_id = video_info.get('id') or video_info.get('webpage_url')
+    if video_id:
+        cached = get_cached_summary(video_id)
+        if cached:
+            LOG.debug("Resumo em cache para %s", video_id)
+            return cached
+    
     try:
         title = video_info.get('title', 'N/A')
         description = video_info.get('description', '')
         
         # Limita descrição para não exceder tokens
-        if description and len(description) > 500:
-            description = description[:500] + "..."
+        if description:
+            description = truncate_utf8(description, SUMMARY_DESCRIPTION_MAX_BYTES)
         
         prompt = f"""Crie um resumo CURTO e OBJETIVO deste vídeo em 3-4 pontos principais.
 Use bullets (•) e seja direto.
@@ -3156,10 +4110,18 @@ Descrição: {description or 'Sem descrição'}
 
 Responda APENAS com o resumo, sem introduções."""
         
-        summary = await chat_with_ai(
-            prompt,
-            system_prompt="Você é um assistente que resume vídeos de forma clara e concisa."
+        # Chamada direta ao Groq (sem passar por chat_with_ai), em thread
+        response = await asyncio.to_thread(
+            groq_client.chat.completions.create,
+            model=_select_groq_model(prompt, _SUMMARY_SYSTEM_MESSAGE["content"]),
+            messages=[_SUMMARY_SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=1024
         )
+        summary = response.choices[0].message.content
+        
+        if summary and video_id:
+            save_cached_summary(video_id, summary)
         
         return summary if summary else ""
         
@@ -3168,6 +4130,13 @@ Responda APENAS com o resumo, sem introduções."""
         return ""
 
 
+# Palavras-chave compiladas uma única vez: resolvem a maioria das intenções
+# sem precisar de uma chamada ao Groq (~1s por mensagem)
+_HELP_RE = re.compile(r'\b(ajuda|help|como|tutorial|instru[cç](?:[aã]o|[oõ]es))\b', re.IGNORECASE)
+_DL_RE = re.compile(r'\b(baix\w*|download\w*|pegar|salvar)\b', re.IGNORECASE)
+INTENT_LLM_MIN_LENGTH = 20  # Mensagens curtas sem palavra-chave não vão para o LLM
+
+
 async def analyze_user_intent(message: str) -> dict:
     """
     Analisa a intenção do usuário na mensagem.
@@ -3182,7 +4151,13 @@ async def analyze_user_intent(message: str) -> dict:
     if URL_RE.search(message):
         return {'intent': 'download', 'confidence': 1.0}
     
-    if not groq_client:
+    # ⚡ Atalho por palavras-chave (sem round-trip ao Groq)
+    if _HELP_RE.search(message):
+        return {'intent': 'help', 'confidence': 0.85}
+    if _DL_RE.search(message):
+        return {'intent': 'download', 'confidence': 0.85}
+    
+    if not groq_client or len(message) <= INTENT_LLM_MIN_LENGTH:
         return {'intent': 'chat', 'confidence': 0.5}
     
     try:
@@ -3196,13 +4171,18 @@ Responda APENAS com uma das opções:
 
 Responda APENAS uma palavra."""
         
-        response = await chat_with_ai(
-            prompt,
-            system_prompt="Você analisa intenções de usuários. Responda apenas: download, help ou chat."
+        # Chamada direta ao Groq (sem passar por chat_with_ai), em thread
+        response = await asyncio.to_thread(
+            groq_client.chat.completions.create,
+            model=GROQ_FAST_MODEL,
+            messages=[_INTENT_SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
+            temperature=0,
+            max_tokens=3  # Resposta é uma única palavra
         )
+        content = response.choices[0].message.content
         
-        if response:
-            intent = response.strip().lower()
+        if content:
+            intent = content.strip().lower()
             if intent in ['download', 'help', 'chat']:
                 return {'intent': intent, 'confidence': 0.9}
         
@@ -3227,8 +4207,7 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
     LOG.info("🛒 Usuário %d iniciou compra de premium", user_id)
     
     # Verifica se já é premium
-    stats = get_user_download_stats(user_id)
-    if stats["is_premium"]:
+    if is_premium_cached(user_id):
         await query.edit_message_text(
             "<b>Você já é Premium</b>\n\n"
             "Continue aproveitando os benefícios ilimitados.",
@@ -3254,48 +4233,107 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode="HTML"
     )
     
+    # O handler retorna logo; a criação do PIX roda nos workers da fila
+    ensure_pix_workers()
+    await PIX_QUEUE.put({"query": query, "user_id": user_id, "username": username})
+
+
+class PixPaymentError(Exception):
+    """Falha ao gerar o pagamento PIX"""
+
+class MercadoPagoAuthError(PixPaymentError):
+    """Token do Mercado Pago recusado (HTTP 401)"""
+
+class MercadoPagoConfigError(PixPaymentError):
+    """SDK do Mercado Pago não configurado"""
+
+class PixQRCodeError(PixPaymentError):
+    """Resposta do Mercado Pago sem os dados do QR Code"""
+
+# Mensagem para o usuário por tipo de erro (demais erros usam a genérica)
+PIX_ERROR_MESSAGES = {
+    MercadoPagoAuthError: "Token do Mercado Pago inválido ou expirado.",
+    PixQRCodeError: "Erro ao gerar QR Code PIX. Verifique as credenciais.",
+    MercadoPagoConfigError: "Sistema de pagamento não configurado no servidor.",
+}
+PIX_ERROR_DEFAULT_MESSAGE = "Erro ao processar pagamento."
+
+# Partes fixas do pedido de pagamento PIX (copiado e completado por usuário)
+PIX_PAYMENT_TEMPLATE = {
+    "transaction_amount": float(PREMIUM_PRICE),
+    "payment_method_id": "pix",
+    "payer": {
+        "last_name": "Telegram"
+    },
+    "metadata": {
+        "plan": "premium",
+        "duration_days": PREMIUM_DURATION_DAYS
+    }
+}
+
+# Adiciona notification_url se tiver RENDER_EXTERNAL_URL
+if os.getenv("RENDER_EXTERNAL_URL"):
+    PIX_PAYMENT_TEMPLATE["notification_url"] = f"{os.getenv('RENDER_EXTERNAL_URL')}/webhook/pix"
+    LOG.info("Notification URL configurada: %s", PIX_PAYMENT_TEMPLATE["notification_url"])
+
+# Fila de geração de PIX: chamadas ao Mercado Pago e envio do QR Code não
+# seguram o handler do callback
+PIX_WORKERS = 4
+PIX_QUEUE = asyncio.Queue()
+PIX_WORKER_TASKS = []
+
+def ensure_pix_workers():
+    """Garante que os workers da fila de PIX estão rodando"""
+    PIX_WORKER_TASKS[:] = [task for task in PIX_WORKER_TASKS if not task.done()]
+    while len(PIX_WORKER_TASKS) < PIX_WORKERS:
+        PIX_WORKER_TASKS.append(asyncio.create_task(pix_worker()))
+
+
+async def pix_worker():
+    """Consome pedidos de PIX da fila"""
+    while True:
+        job = await PIX_QUEUE.get()
+        try:
+            await process_pix_job(**job)
+        except Exception as e:
+            LOG.exception("Erro no worker de PIX: %s", e)
+        finally:
+            PIX_QUEUE.task_done()
+
+
+async def process_pix_job(query, user_id: int, username: str):
+    """Cria o pagamento PIX, envia o QR Code e inicia o monitoramento"""
     try:
-        LOG.info("Inicializando SDK do Mercado Pago")
-        sdk = mercadopago.SDK(MERCADOPAGO_ACCESS_TOKEN)
+        if MP_CLIENT is None:
+            raise MercadoPagoConfigError("MERCADOPAGO_ACCESS_TOKEN não configurado")
         
         # Prepara dados do pagamento
-        payment_data = {
-            "transaction_amount": float(PREMIUM_PRICE),
-            "description": f"Plano Premium - Bot Downloads (User ID: {user_id})",
-            "payment_method_id": "pix",
-            "payer": {
-                "email": f"user{user_id}@telegram.bot",
-                "first_name": username,
-                "last_name": "Telegram"
-            },
-            "external_reference": f"PIX_{user_id}_{int(time.time())}",
-            "metadata": {
-                "user_id": user_id,
-                "plan": "premium",
-                "duration_days": PREMIUM_DURATION_DAYS
-            }
-        }
-        
-        # Adiciona notification_url se tiver RENDER_EXTERNAL_URL
-        render_url = os.getenv("RENDER_EXTERNAL_URL")
-        if render_url:
-            payment_data["notification_url"] = f"{render_url}/webhook/pix"
-            LOG.info("Notification URL configurada: %s/webhook/pix", render_url)
+        payment_data = copy.deepcopy(PIX_PAYMENT_TEMPLATE)
+        payment_data["description"] = f"Plano Premium - Bot Downloads (User ID: {user_id})"
+        payment_data["payer"]["email"] = f"user{user_id}@telegram.bot"
+        payment_data["payer"]["first_name"] = username
+        payment_data["external_reference"] = f"PIX_{user_id}_{int(time.time())}"
+        payment_data["metadata"]["user_id"] = user_id
         
         LOG.info("Criando pagamento PIX para usuário %d - Valor: R$ %.2f", user_id, PREMIUM_PRICE)
         
-        # Cria o pagamento
-        payment_response = sdk.payment().create(payment_data)
+        # Cria o pagamento (a chave de idempotência evita PIX duplicado em retentativas)
+        payment_response = await MP_CLIENT.post(
+            "/v1/payments",
+            json=payment_data,
+            headers={"X-Idempotency-Key": payment_data["external_reference"]},
+        )
         
-        LOG.info("Resposta do Mercado Pago - Status: %s", payment_response.get("status"))
+        LOG.info("Resposta do Mercado Pago - Status: %s", payment_response.status_code)
         
         # Valida resposta
-        if payment_response["status"] != 201:
+        if payment_response.status_code != 201:
             LOG.error("Erro ao criar pagamento - Status %s: %s", 
-                     payment_response.get("status"), payment_response)
-            raise Exception(f"Mercado Pago retornou erro: status {payment_response.get('status')}")
+                     payment_response.status_code, payment_response.text)
+            error_cls = MercadoPagoAuthError if payment_response.status_code == 401 else PixPaymentError
+            raise error_cls(f"Mercado Pago retornou erro: status {payment_response.status_code}")
         
-        payment = payment_response["response"]
+        payment = payment_response.json()
         payment_id = payment.get("id")
         
         LOG.info("✅ Payment criado - ID: %s, Status: %s", payment_id, payment.get("status"))
@@ -3303,17 +4341,17 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
         # Valida estrutura do PIX
         if "point_of_interaction" not in payment:
             LOG.error("Resposta sem point_of_interaction: %s", payment)
-            raise Exception("PIX não foi gerado - point_of_interaction ausente")
+            raise PixQRCodeError("PIX não foi gerado - point_of_interaction ausente")
         
         poi = payment["point_of_interaction"]
         if "transaction_data" not in poi:
             LOG.error("point_of_interaction sem transaction_data: %s", poi)
-            raise Exception("PIX não foi gerado - transaction_data ausente")
+            raise PixQRCodeError("PIX não foi gerado - transaction_data ausente")
         
         td = poi["transaction_data"]
         if "qr_code" not in td or "qr_code_base64" not in td:
             LOG.error("transaction_data sem QR codes: %s", td)
-            raise Exception("PIX não foi gerado - QR codes ausentes")
+            raise PixQRCodeError("PIX não foi gerado - QR codes ausentes")
         
         # Extrai informações do PIX
         pix_info = {
@@ -3327,15 +4365,13 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # Salva no banco de dados
         try:
-            with DB_LOCK:
-                conn = sqlite3.connect(DB_FILE, timeout=10)
+            with db_conn() as conn:
                 c = conn.cursor()
                 c.execute("""
                     INSERT INTO pix_payments (user_id, amount, pix_key, status) 
                     VALUES (?, ?, ?, 'pending')
                 """, (user_id, pix_info["amount"], payment_id))
                 conn.commit()
-                conn.close()
             LOG.info("Pagamento salvo no banco de dados")
         except Exception as e:
             LOG.error("Erro ao salvar pagamento no banco: %s", e)
@@ -3354,35 +4390,23 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
             "Expira em 30 minutos. Ativação automática em até 60 segundos após a confirmação."
         )
         
-        # Tenta enviar QR Code como imagem
+        # Tenta enviar QR Code como imagem (o base64 do Mercado Pago já é um PNG)
         qr_sent = False
-        if PIL_AVAILABLE:
-            try:
-                LOG.info("Tentando enviar QR Code como imagem")
-                
-                # Decodifica QR Code
-                qr_bytes = base64.b64decode(pix_info["qr_code_base64"])
-                qr_image = Image.open(io.BytesIO(qr_bytes))
-                
-                # Salva temporariamente
-                qr_path = f"/tmp/qr_{user_id}_{int(time.time())}.png"
-                qr_image.save(qr_path)
-                
-                # Envia imagem
-                with open(qr_path, "rb") as photo:
-                    await query.message.reply_photo(
-                        photo=photo,
-                        caption=message_text,
-                        parse_mode="HTML"
-                    )
-                
-                # Remove arquivo temporário
-                os.remove(qr_path)
-                qr_sent = True
-                LOG.info("✅ QR Code enviado como imagem")
-                
-            except Exception as e:
-                LOG.error("Erro ao enviar QR Code como imagem: %s", e)
+        try:
+            LOG.info("Tentando enviar QR Code como imagem")
+            
+            qr_photo = io.BytesIO(base64.b64decode(pix_info["qr_code_base64"]))
+            qr_photo.name = "qr.png"
+            await query.message.reply_photo(
+                photo=qr_photo,
+                caption=message_text,
+                parse_mode="HTML"
+            )
+            qr_sent = True
+            LOG.info("✅ QR Code enviado como imagem")
+            
+        except Exception as e:
+            LOG.error("Erro ao enviar QR Code como imagem: %s", e)
         
         # Se enviou imagem, envia código separado; senão envia tudo junto
         if qr_sent:
@@ -3411,7 +4435,7 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # Inicia monitoramento do pagamento
         LOG.info("Iniciando monitoramento do pagamento %s", payment_id)
-        asyncio.create_task(monitor_payment_status(user_id, payment_id))
+        track_payment(user_id, payment_id)
         
         LOG.info("✅ Processo completo - Pagamento %s criado e em monitoramento", payment_id)
         
@@ -3419,15 +4443,7 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
         LOG.exception("❌ ERRO ao gerar pagamento PIX: %s", e)
         
         # Determina mensagem de erro específica
-        error_msg = str(e).lower()
-        if "401" in error_msg or "unauthorized" in error_msg:
-            error_detail = "Token do Mercado Pago inválido ou expirado."
-        elif "point_of_interaction" in error_msg or "qr" in error_msg:
-            error_detail = "Erro ao gerar QR Code PIX. Verifique as credenciais."
-        elif "mercadopago_access_token" in error_msg:
-            error_detail = "Sistema de pagamento não configurado no servidor."
-        else:
-            error_detail = f"Erro ao processar pagamento."
+        error_detail = PIX_ERROR_MESSAGES.get(type(e), PIX_ERROR_DEFAULT_MESSAGE)
         
         await query.edit_message_text(
             f"<b>Erro ao Gerar Pagamento</b>\n\n"
@@ -3437,74 +4453,144 @@ async def callback_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
-async def monitor_payment_status(user_id: int, payment_id: str):
-    """Monitora o status do pagamento em segundo plano"""
+def track_payment(user_id: int, payment_id: str):
+    """Registra o pagamento no poller global (inicia o poller se necessário)"""
     if not MERCADOPAGO_AVAILABLE or not MERCADOPAGO_ACCESS_TOKEN:
         LOG.error("Não é possível monitorar pagamento - Mercado Pago não configurado")
         return
     
-    try:
-        sdk = mercadopago.SDK(MERCADOPAGO_ACCESS_TOKEN)
-        max_attempts = 60  # 30 minutos (30s * 60)
+    PENDING_PAYMENTS[str(payment_id)] = {
+        "user_id": user_id,
+        "expires_at": time.time() + PAYMENT_MONITOR_TIMEOUT,
+    }
+    PAYMENT_POLLER["delay"] = PAYMENT_POLL_INITIAL_DELAY
+    
+    task = PAYMENT_POLLER["task"]
+    if task is None or task.done():
+        PAYMENT_POLLER["task"] = asyncio.create_task(payment_poller())
+
+
+async def payment_poller():
+    """Poller único de pagamentos PIX pendentes
+
+    Aguarda a notificação do webhook /webhook/pix ou o fim do intervalo e então
+    consulta todos os pagamentos pendentes numa única busca. Encerra quando não
+    há mais pagamentos pendentes.
+    """
+    LOG.info("🔍 Poller de pagamentos iniciado (%d pendentes)", len(PENDING_PAYMENTS))
+    
+    while PENDING_PAYMENTS:
+        delay = PAYMENT_POLLER["delay"]
+        wait = delay + random.uniform(0, delay * PAYMENT_POLL_JITTER)
+        try:
+            await asyncio.wait_for(PAYMENT_POLLER_WAKE.wait(), timeout=wait)
+            LOG.info("🔔 Webhook de pagamento recebido")
+        except asyncio.TimeoutError:
+            PAYMENT_POLLER["delay"] = min(delay * 2, PAYMENT_POLL_MAX_DELAY)
+        PAYMENT_POLLER_WAKE.clear()
+        
+        try:
+            await check_pending_payments()
+        except Exception as e:
+            LOG.exception("Erro ao verificar pagamentos pendentes: %s", e)
+    
+    LOG.info("Poller de pagamentos encerrado - nenhum pagamento pendente")
+
+
+async def check_pending_payments():
+    """Consulta os pagamentos recentes e trata os pendentes que mudaram de status"""
+    now = time.time()
+    for payment_key, pending in list(PENDING_PAYMENTS.items()):
+        if now >= pending["expires_at"]:
+            PENDING_PAYMENTS.pop(payment_key, None)
+            LOG.info("⏰ Timeout de monitoramento para pagamento %s após %d minutos", 
+                    payment_key, PAYMENT_MONITOR_TIMEOUT // 60)
+    
+    if not PENDING_PAYMENTS:
+        return
+    
+    # A busca cobre todos os PIX criados dentro da janela de monitoramento;
+    # pagina (paging.total/offset) até achar todos os monitorados, para que
+    # contas com mais de PAYMENT_SEARCH_LIMIT pagamentos na janela não percam PIX
+    results = []
+    wanted = set(PENDING_PAYMENTS)
+    offset = 0
+    while True:
+        search_response = await MP_CLIENT.get("/v1/payments/search", params={
+            "sort": "date_created",
+            "criteria": "desc",
+            "range": "date_created",
+            "begin_date": f"NOW-{PAYMENT_MONITOR_TIMEOUT // 60}MINUTES",
+            "end_date": "NOW",
+            "limit": PAYMENT_SEARCH_LIMIT,
+            "offset": offset,
+        })
+        
+        if search_response.status_code != 200:
+            LOG.warning("Erro ao buscar pagamentos: status %s", search_response.status_code)
+            break
         
-        LOG.info("🔍 Monitorando pagamento %s (max %d tentativas)", payment_id, max_attempts)
+        data = search_response.json()
+        page = data.get("results", [])
+        results.extend(page)
+        wanted.difference_update(str(payment["id"]) for payment in page)
         
-        for attempt in range(max_attempts):
-            await asyncio.sleep(30)  # Verifica a cada 30 segundos
+        offset += len(page)
+        total = (data.get("paging") or {}).get("total", 0)
+        if not wanted or not page or offset >= total:
+            break
+    
+    status_messages = {
+        "rejected": "rejeitado",
+        "cancelled": "cancelado",
+        "refunded": "reembolsado"
+    }
+    
+    for payment in results:
+        payment_id = payment["id"]
+        pending = PENDING_PAYMENTS.get(str(payment_id))
+        if pending is None:
+            continue
+        
+        status = payment["status"]
+        user_id = pending["user_id"]
+        LOG.debug("Pagamento %s - Status: %s", payment_id, status)
+        
+        if status == "approved":
+            # Pagamento aprovado!
+            PENDING_PAYMENTS.pop(str(payment_id), None)
+            LOG.info("🎉 Pagamento %s APROVADO!", payment_id)
+            await activate_premium(user_id, payment_id)
             
+        elif status in status_messages:
+            PENDING_PAYMENTS.pop(str(payment_id), None)
+            LOG.info("⚠️ Pagamento %s não concluído: %s", payment_id, status)
+            
+            # Notifica usuário
             try:
-                payment_response = sdk.payment().get(payment_id)
-                
-                if payment_response["status"] != 200:
-                    LOG.warning("Erro ao consultar pagamento %s: status %s", 
-                              payment_id, payment_response.get("status"))
-                    continue
-                
-                payment = payment_response["response"]
-                status = payment["status"]
-                
-                LOG.debug("Pagamento %s - Status: %s (tentativa %d/%d)", 
-                         payment_id, status, attempt + 1, max_attempts)
-                
-                if status == "approved":
-                    # Pagamento aprovado!
-                    LOG.info("🎉 Pagamento %s APROVADO!", payment_id)
-                    await activate_premium(user_id, payment_id)
-                    break
-                    
-                elif status in ["rejected", "cancelled", "refunded"]:
-                    LOG.info("⚠️ Pagamento %s não concluído: %s", payment_id, status)
-                    
-                    # Notifica usuário
-                    try:
-                        status_messages = {
-                            "rejected": "rejeitado",
-                            "cancelled": "cancelado",
-                            "refunded": "reembolsado"
-                        }
-                        await application.bot.send_message(
-                            chat_id=user_id,
-                            text=(
-                                f"<b>Pagamento {status_messages.get(status, status)}</b>\n\n"
-                                f"ID: <code>{payment_id}</code>\n\n"
-                                "Seu pagamento não foi concluído.\n"
-                                "Se precisar de ajuda, entre em contato com o suporte."
-                            ),
-                            parse_mode="HTML"
-                        )
-                    except Exception as e:
-                        LOG.error("Erro ao notificar usuário sobre falha: %s", e)
-                    break
-                    
+                await application.bot.send_message(
+                    chat_id=user_id,
+                    text=(
+                        f"<b>Pagamento {status_messages[status]}</b>\n\n"
+                        f"ID: <code>{payment_id}</code>\n\n"
+                        "Seu pagamento não foi concluído.\n"
+                        "Se precisar de ajuda, entre em contato com o suporte."
+                    ),
+                    parse_mode="HTML"
+                )
             except Exception as e:
-                LOG.error("Erro ao verificar status do pagamento %s: %s", payment_id, e)
-        
-        if attempt >= max_attempts - 1:
-            LOG.info("⏰ Timeout de monitoramento para pagamento %s após %d minutos", 
-                    payment_id, (max_attempts * 30) // 60)
-            
-    except Exception as e:
-        LOG.exception("Erro crítico no monitoramento do pagamento %s: %s", payment_id, e)
+                LOG.error("Erro ao notificar usuário sobre falha: %s", e)
+
+
+def notify_payment_webhook(payment_id) -> bool:
+    """Acorda o poller de pagamentos (chamado pela thread do Flask).
+
+    Retorna False se o pagamento não está sendo monitorado neste processo.
+    """
+    if str(payment_id) not in PENDING_PAYMENTS:
+        return False
+    APP_LOOP.call_soon_threadsafe(PAYMENT_POLLER_WAKE.set)
+    return True
 
 
 async def activate_premium(user_id: int, payment_id: str):
@@ -3512,33 +4598,13 @@ async def activate_premium(user_id: int, payment_id: str):
     try:
         LOG.info("🔓 Ativando premium para usuário %d - Pagamento: %s", user_id, payment_id)
         
-        # Calcula data de expiração
-        premium_expires = (datetime.now() + timedelta(days=PREMIUM_DURATION_DAYS)).strftime("%Y-%m-%d")
-        
-        # Atualiza banco de dados
-        with DB_LOCK:
-            conn = sqlite3.connect(DB_FILE, timeout=10)
-            c = conn.cursor()
-            
-            # Ativa premium
-            c.execute("""
-                UPDATE user_downloads 
-                SET is_premium=1, premium_expires=? 
-                WHERE user_id=?
-            """, (premium_expires, user_id))
-            
-            # Atualiza status do pagamento
-            c.execute("""
-                UPDATE pix_payments 
-                SET status='confirmed', confirmed_at=CURRENT_TIMESTAMP 
-                WHERE user_id=? AND pix_key=?
-            """, (user_id, payment_id))
-            
-            rows_affected = c.rowcount
-            conn.commit()
-            conn.close()
+        # Confirma o pagamento e ativa o premium numa única transação (um fsync);
+        # None = nenhum registro pendente mudou, então não há o que notificar
+        premium_expires = confirm_pix_payment(payment_id, user_id)
+        if premium_expires is None:
+            return
         
-        LOG.info("✅ Premium ativado no banco de dados (%d linhas atualizadas)", rows_affected)
+        LOG.info("✅ Premium ativado no banco de dados")
         
         # Notifica o usuário
         await application.bot.send_message(
@@ -3654,6 +4720,7 @@ async def callback_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "cancel":
         # Remove do cache (LimitedCache não tem del, usa cache.pop)
         PENDING.cache.pop(token, None)
+        PENDING_INFO.pop(token)
         await query.edit_message_text(MESSAGES["download_cancelled"])
         LOG.info("Download cancelado pelo usuário %d", pm["user_id"])
         return
@@ -3710,10 +4777,7 @@ async def callback_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         PENDING.cache.pop(token, None)
         
         # Adiciona à lista de downloads ativos
-        ACTIVE_DOWNLOADS[token] = {
-            "user_id": pm["user_id"],
-            "started_at": time.time()
-        }
+        ACTIVE_DOWNLOADS[token] = ActiveDownload(pm["user_id"], time.time())
         
         await query.edit_message_text(MESSAGES["download_started"])
         
@@ -3732,7 +4796,15 @@ async def _process_download(token: str, pm: dict):
     # Aguarda na fila (semáforo para controlar 2 downloads simultâneos)
     async with DOWNLOAD_SEMAPHORE:
         try:
-            tmpdir = tempfile.mkdtemp(prefix=f"ytbot_")
+            tmp_root, shm_reserved = reserve_download_tmp_root(pm.get("filesize"))
+            try:
+                tmpdir = tempfile.mkdtemp(prefix=DOWNLOAD_DIR_PREFIX, dir=tmp_root)
+            except Exception:
+                release_download_tmp_root(shm_reserved)
+                raise
+            active = ACTIVE_DOWNLOADS.get(token)
+            if active is not None:
+                active.tmpdir = tmpdir
             
             try:
                 await _do_download(token, pm["url"], tmpdir, pm["chat_id"], pm)
@@ -3740,9 +4812,10 @@ async def _process_download(token: str, pm: dict):
                 # Limpa arquivos temporários
                 if tmpdir and os.path.exists(tmpdir):
                     try:
-                        shutil.rmtree(tmpdir, ignore_errors=True)
+                        await asyncio.to_thread(shutil.rmtree, tmpdir, ignore_errors=True)
                     except Exception as e:
                         LOG.error("Erro ao limpar tmpdir: %s", e)
+                release_download_tmp_root(shm_reserved)
                 
                 # Remove da lista de downloads ativos
                 if token in ACTIVE_DOWNLOADS:
@@ -3776,127 +4849,99 @@ async def _do_download(token: str, url: str, tmpdir: str, chat_id: int, pm: dict
     """Executa o download do vídeo"""
     outtmpl = os.path.join(tmpdir, "%(title)s.%(ext)s")
     last_percent = -1
+    last_edit_ts = 0.0
+    edit_future = None
     
     # Resolve universal links da Shopee
-    if 'shopee' in url.lower() and 'universal-link' in url:
+    if url_kind(url) in SHOPEE_URL_KINDS and SHOPEE_UNIVERSAL_LINK_RE.search(url):
         url = resolve_shopee_universal_link(url)
         LOG.info("Usando URL resolvida para download: %s", url[:100])
     
     # Verifica se é Shopee Video - precisa tratamento especial
-    if 'sv.shopee' in url.lower() or 'share-video' in url.lower():
+    if url_kind(url) == "sv_shopee":
         LOG.info("Detectado Shopee Video, usando método alternativo")
         await _download_shopee_video(url, tmpdir, chat_id, pm)
         return
     
-    def progress_hook(d):
-        nonlocal last_percent
+    def on_downloading(d):
+        # Chamado a cada bloco baixado: sai cedo enquanto não há nada a editar
+        nonlocal last_percent, last_edit_ts, edit_future
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        if not total:
+            return
+        
+        # Verifica se o tamanho está excedendo o limite durante download
+        if total > MAX_FILE_SIZE:
+            LOG.warning("Download cancelado: arquivo excede 50 MB (%d bytes)", total)
+            raise Exception(f"Arquivo muito grande: {total} bytes")
+        
+        percent = int((d.get("downloaded_bytes") or 0) * 100 / total)
+        if percent == last_percent or percent % 10:
+            return
+        now = time.monotonic()
+        # Edita no máximo a cada PROGRESS_EDIT_INTERVAL e nunca com
+        # uma edição anterior ainda pendente
+        if now - last_edit_ts < PROGRESS_EDIT_INTERVAL or (edit_future is not None and not edit_future.done()):
+            return
+        last_percent = percent
+        last_edit_ts = now
+        text = MESSAGES["download_progress"].format(
+            percent=percent,
+            bar=PROGRESS_BARS[min(percent, 100) // 5]
+        )
         try:
-            status = d.get("status")
-            if status == "downloading":
-                downloaded = d.get("downloaded_bytes", 0) or 0
-                total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
-                
-                # Verifica se o tamanho está excedendo o limite durante download
-                if total and total > MAX_FILE_SIZE:
-                    LOG.warning("Download cancelado: arquivo excede 50 MB (%d bytes)", total)
-                    raise Exception(f"Arquivo muito grande: {total} bytes")
-                
-                if total:
-                    percent = int(downloaded * 100 / total)
-                    if percent != last_percent and percent % 10 == 0:
-                        last_percent = percent
-                        blocks = int(percent / 5)
-                        bar = "█" * blocks + "░" * (20 - blocks)
-                        text = MESSAGES["download_progress"].format(
-                            percent=percent,
-                            bar=bar
-                        )
-                        try:
-                            asyncio.run_coroutine_threadsafe(
-                                application.bot.edit_message_text(
-                                    text=text, 
-                                    chat_id=pm["chat_id"], 
-                                    message_id=pm["message_id"]
-                                ),
-                                APP_LOOP,
-                            )
-                        except Exception as e:
-                            LOG.debug("Erro ao atualizar progresso: %s", e)
-            elif status == "finished":
-                try:
-                    asyncio.run_coroutine_threadsafe(
-                        application.bot.edit_message_text(
-                            text=MESSAGES["download_complete"], 
-                            chat_id=pm["chat_id"], 
-                            message_id=pm["message_id"]
-                        ),
-                        APP_LOOP,
-                    )
-                except Exception as e:
-                    LOG.debug("Erro ao atualizar status finished: %s", e)
+            edit_future = asyncio.run_coroutine_threadsafe(
+                application.bot.edit_message_text(
+                    text=text, 
+                    chat_id=pm["chat_id"], 
+                    message_id=pm["message_id"]
+                ),
+                APP_LOOP,
+            )
         except Exception as e:
-            LOG.error("Erro no progress_hook: %s", e)
+            LOG.debug("Erro ao atualizar progresso: %s", e)
+
+    def on_finished(d):
+        try:
+            asyncio.run_coroutine_threadsafe(
+                application.bot.edit_message_text(
+                    text=MESSAGES["download_complete"], 
+                    chat_id=pm["chat_id"], 
+                    message_id=pm["message_id"]
+                ),
+                APP_LOOP,
+            )
+        except Exception as e:
+            LOG.debug("Erro ao atualizar status finished: %s", e)
+
+    # Despacho por status: um lookup de dict em vez da cadeia if/elif por bloco
+    progress_handlers = {"downloading": on_downloading, "finished": on_finished}
+
+    def progress_hook(d):
+        handler = progress_handlers.get(d.get("status"))
+        if handler is not None:
+            try:
+                handler(d)
+            except Exception as e:
+                LOG.error("Erro no progress_hook: %s", e)
 
     # Configurações do yt-dlp
-    is_shopee = 'shopee' in url.lower() or 'shope.ee' in url.lower()
+    is_shopee = url_kind(url) in SHOPEE_URL_KINDS
 
     # Obtém qualidade escolhida pelo usuário (para YouTube)
     quality = pm.get("quality", None)
 
     ydl_opts = {
+        **YDL_BASE_OPTS,
         "outtmpl": outtmpl,
         "progress_hooks": [progress_hook],
-        "quiet": False,
-        "logger": LOG,
         "format": get_format_for_url(url, quality=quality),
-        "format_sort": ["res", "ext:mp4:m4a"],
-        "ignore_no_formats_error": True,
-        "merge_output_format": "mp4",
-        "concurrent_fragment_downloads": 1,
-        "force_ipv4": True,
-        "socket_timeout": 60,
-        "http_chunk_size": 262144,
-        "retries": 25,
-        "fragment_retries": 25,
-        "no_check_certificate": True,
-        "prefer_insecure": True,
-        "no_cache_dir": True,
-        "buffersize": 1024 * 64,
-        "skip_unavailable_fragments": True,
-        "postprocessors": [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }],
-        "keepvideo": False,
-        "prefer_ffmpeg": True,
     }
     
     # Configurações específicas para Shopee
     if is_shopee:
         LOG.info("🛍️ Aplicando configurações otimizadas para Shopee")
-        ydl_opts.update({
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "*/*",
-                "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Referer": "https://shopee.com.br/",
-                "Origin": "https://shopee.com.br",
-                "Sec-Fetch-Dest": "video",
-                "Sec-Fetch-Mode": "no-cors",
-                "Sec-Fetch-Site": "cross-site",
-            },
-            "extractor_args": {
-                "shopee": {
-                    "api_ver": "v4"
-                }
-            },
-            # Força download direto sem fragmentação
-            "noprogress": False,
-            "keep_fragments": False,
-            "socket_timeout": 60,  # Aumentado para Shopee também
-            "retries": 25,  # ✅ CORRIGIDO: Número simples
-        })
+        ydl_opts.update(SHOPEE_YDL_DOWNLOAD_OPTS)
     
     # Adiciona cookies apropriados
     cookie_file = get_cookie_for_url(url)
@@ -3905,7 +4950,9 @@ async def _do_download(token: str, url: str, tmpdir: str, chat_id: int, pm: dict
 
     # Executa download
     try:
-        await asyncio.to_thread(lambda: _run_ydl(ydl_opts, [url]))
+        # A extração feita na confirmação evita uma nova ida ao site
+        info = PENDING_INFO.pop(token)
+        await asyncio.get_running_loop().run_in_executor(YTDLP_EXECUTOR, _run_ydl, ydl_opts, [url], info)
     except Exception as e:
         error_msg = str(e)
         LOG.exception("Erro no yt-dlp: %s", e)
@@ -3932,25 +4979,20 @@ async def _do_download(token: str, url: str, tmpdir: str, chat_id: int, pm: dict
             await _notify_error(pm, "error_network")
         return
 
-    # Envia arquivos baixados
-    arquivos = [
-        os.path.join(tmpdir, f) 
-        for f in os.listdir(tmpdir) 
-        if os.path.isfile(os.path.join(tmpdir, f))
-    ]
+    # Envia arquivos baixados (scandir: tipo e tamanho sem syscalls extras)
+    with os.scandir(tmpdir) as entries:
+        arquivos = [(entry.path, entry.stat().st_size) for entry in entries if entry.is_file()]
     
     if not arquivos:
         LOG.error("Nenhum arquivo baixado")
         await _notify_error(pm, "error_unknown")
         return
 
-    for path in arquivos:
+    # Verifica se o arquivo excede 50 MB (EXCETO Shopee - sem limite)
+    is_shopee = url_kind(pm["url"]) in SHOPEE_URL_KINDS
+    
+    for path, tamanho in arquivos:
         try:
-            tamanho = os.path.getsize(path)
-            
-            # Verifica se o arquivo excede 50 MB (EXCETO Shopee - sem limite)
-            is_shopee = 'shopee' in pm["url"].lower()
-            
             if not is_shopee and tamanho > MAX_FILE_SIZE:
                 LOG.error("Arquivo muito grande após download: %d bytes", tamanho)
                 await _notify_error(pm, "error_file_large")
@@ -3974,7 +5016,7 @@ async def _do_download(token: str, url: str, tmpdir: str, chat_id: int, pm: dict
                     LOG.debug("Erro ignorado: %s", type(e).__name__)
                 
                 # Remove marca d'água - POSIÇÃO CORRETA: MEIO DIREITO ✅
-                path = WATERMARK_REMOVER.remove(path, position='middle_right')
+                path = await asyncio.to_thread(WATERMARK_REMOVER.remove, path, position='middle_right')
                 
                 # Se falhar, tenta outras posições
                 if os.path.exists(path) and 'temp' not in path:
@@ -3982,18 +5024,17 @@ async def _do_download(token: str, url: str, tmpdir: str, chat_id: int, pm: dict
                     LOG.info("   Tentando posições alternativas...")
                     for pos in ['middle_right_high', 'middle_right_low', 'middle_center', 'bottom_right']:
                         try:
-                            path = WATERMARK_REMOVER.remove(path, position=pos)
+                            path = await asyncio.to_thread(WATERMARK_REMOVER.remove, path, position=pos)
                             break
                         except:
                             continue
             
-            # Envia o vídeo
+            # Envia o vídeo em streaming (o arquivo não é carregado inteiro na memória)
+            caption = "Aproveite o seu vídeo."
             with open(path, "rb") as fh:
-                caption = "Aproveite o seu vídeo."
-                
                 await application.bot.send_video(
                     chat_id=chat_id,
-                    video=fh,
+                    video=streamed_video(fh, path),
                     caption=caption
                 )
                     
@@ -4019,10 +5060,22 @@ async def _do_download(token: str, url: str, tmpdir: str, chat_id: int, pm: dict
     except Exception as e:
         LOG.error("Erro ao enviar mensagem final: %s", e)
 
-def _run_ydl(options, urls):
-    """Executa yt-dlp com as opções fornecidas e retry automático em caso de falha de conexão"""
+def _run_ydl(options, urls, info=None):
+    """Executa yt-dlp com as opções fornecidas e retry automático em caso de falha de conexão.
+
+    Com `info` (extração já feita), baixa direto dele; se as URLs dos formatos
+    tiverem expirado, cai para uma extração nova.
+    """
     def execute():
         with yt_dlp.YoutubeDL(options) as ydl:
+            if info is not None:
+                try:
+                    ydl.process_ie_result(copy.deepcopy(info), download=True)
+                    return
+                except Exception as e:
+                    if "muito grande" in str(e):
+                        raise
+                    LOG.warning("♻️ Download com info reaproveitado falhou (%s) - extraindo de novo", e)
             ydl.download(urls)
     
     # 🔧 FIX YOUTUBE: Tenta novamente se falhar por conexão recusada
@@ -4044,14 +5097,12 @@ async def _notify_error(pm: dict, error_key: str):
         LOG.error("Erro ao notificar erro: %s", e)
 
 def _cleanup_pending():
-    """Remove requisições pendentes expiradas"""
+    """Remove requisições pendentes expiradas (só visita as que expiraram)"""
     now = time.time()
-    expired = [
-        token for token, pm in PENDING.cache.items()
-        if now - pm["timestamp"] > PENDING_EXPIRE_SECONDS
-    ]
-    for token in expired:
+    while PENDING_EXPIRY_HEAP and PENDING_EXPIRY_HEAP[0][0] < now:
+        _, token = heapq.heappop(PENDING_EXPIRY_HEAP)
         PENDING.cache.pop(token, None)
+        PENDING_INFO.pop(token)
     
     # LimitedCache já controla tamanho máximo automaticamente
     # Não precisa mais do while len(PENDING)
@@ -4067,34 +5118,55 @@ application.add_handler(CommandHandler("premium", premium_cmd))
 application.add_handler(CommandHandler("ai", ai_cmd))
 application.add_handler(CommandHandler("buscar", buscar_cmd))  # ← Comando IA
 application.add_handler(CommandHandler("mensal", mensal_cmd))  # ← Comando relatório mensal
-application.add_handler(CallbackQueryHandler(callback_confirm, pattern=r"^(dl:|cancel:|quality:|back:)"))
-application.add_handler(CallbackQueryHandler(callback_buy_premium, pattern=r"^subscribe:"))
+_CB_CONFIRM_RE = re.compile(r"^(?:dl|cancel|quality|back):", re.ASCII)
+_CB_SUBSCRIBE_RE = re.compile(r"^subscribe:", re.ASCII)
+application.add_handler(CallbackQueryHandler(callback_confirm, pattern=_CB_CONFIRM_RE))
+application.add_handler(CallbackQueryHandler(callback_buy_premium, pattern=_CB_SUBSCRIBE_RE))
 application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
 
 # ============================
 # FLASK ROUTES
 # ============================
 
+def ojsonify(obj, status: int = 200) -> Response:
+    """Resposta JSON serializada com orjson (quando disponível)"""
+    return Response(json_dumps(obj), status=status, mimetype="application/json")
+
 @app.route(f"/{TOKEN}", methods=["POST"])
 def webhook():
     """Endpoint webhook para receber updates do Telegram"""
+    # Rejeita requisições forjadas antes de ler/decodificar o corpo
+    # (bytes: compare_digest com str não-ASCII levanta TypeError -> 500)
+    if WEBHOOK_SECRET and not hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), WEBHOOK_SECRET.encode()
+    ):
+        return "", 401
+    
+    # Fetcher ainda não consome update_queue: 503 faz o Telegram reenviar
+    # o update em vez de ele ficar parado na fila
+    if not application.running:
+        return "", 503
+    
     try:
         # 📊 Registra atividade
         health_monitor.record_activity("telegram")
         LAST_ACTIVITY["flask"] = time.time()
         
-        update_data = request.get_json(force=True)
+        update_data = request.get_json(force=True, cache=False)
         
         # Valida se tem dados
         if not update_data:
             LOG.warning("⚠️ Webhook recebeu dados vazios")
             return jsonify({"status": "no_data"}), 200
         
+        # update_queue é um asyncio.Queue do APP_LOOP: put_nowait agendado via
+        # call_soon_threadsafe é seguro e não cria Future por update.
+        # O fetcher do Application (iniciado no __main__) consome a fila.
         update = Update.de_json(update_data, application.bot)
-        asyncio.run_coroutine_threadsafe(application.process_update(update), APP_LOOP)
+        APP_LOOP.call_soon_threadsafe(application.update_queue.put_nowait, update)
         
         # IMPORTANTE: Sempre retorna 200 OK
-        return jsonify({"status": "ok"}), 200
+        return "", 200
         
     except Exception as e:
         LOG.exception("Falha ao processar webhook: %s", e)
@@ -4108,6 +5180,58 @@ def index():
     """Rota principal"""
     return "🤖 Bot de Download Ativo"
 
+# Carimbos ISO com resolução de segundo: probes no mesmo segundo
+# (e atividades que não mudaram) reutilizam a string já formatada
+@functools.lru_cache(maxsize=16)
+def iso_second(ts: int) -> str:
+    return datetime.fromtimestamp(ts).isoformat()
+
+def iso_now() -> str:
+    return iso_second(int(time.time()))
+
+# Cache da contagem de usuários do /diagnostics: probes repetidos
+# compartilham uma única consulta ao banco a cada DIAG_CACHE_TTL
+DIAG_CACHE_TTL = 30
+DIAG_CACHE = {"db": (0.0, None)}
+DIAG_CACHE_LOCK = threading.Lock()
+
+# Conectividade com a API do Telegram verificada em background no APP_LOOP:
+# os endpoints só leem o último resultado, sem esperar I/O
+BOT_REFRESH_INTERVAL = 60
+BOT_API_STATUS = {"status": "pending", "checked_at": 0.0, "future": None}
+
+def _cached_diag_check(key: str, refresh):
+    """Retorna o resultado em cache de uma verificação ou a executa de novo"""
+    with DIAG_CACHE_LOCK:
+        ts, value = DIAG_CACHE[key]
+        if value is not None and time.time() - ts < DIAG_CACHE_TTL:
+            return value
+        value = refresh()
+        DIAG_CACHE[key] = (time.time(), value)
+        return value
+
+async def bot_refresh_loop():
+    """Consulta get_me() a cada BOT_REFRESH_INTERVAL segundos"""
+    while True:
+        try:
+            await application.bot.get_me()
+            BOT_API_STATUS["status"] = "ok"
+        except Exception as e:
+            BOT_API_STATUS["status"] = f"error: {e}"
+        BOT_API_STATUS["checked_at"] = time.time()
+        await asyncio.sleep(BOT_REFRESH_INTERVAL)
+
+def start_bot_refresh():
+    """Agenda bot_refresh_loop no APP_LOOP (uma única vez)"""
+    with DIAG_CACHE_LOCK:
+        if BOT_API_STATUS["future"] is None:
+            BOT_API_STATUS["future"] = asyncio.run_coroutine_threadsafe(bot_refresh_loop(), APP_LOOP)
+
+def _fetch_total_users():
+    # O cache de statements do sqlite3 (por conexão do pool) reaproveita o COUNT(*) já preparado
+    with db_reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM user_downloads").fetchone()[0]
+
 @app.route("/diagnostics")
 def diagnostics():
     """Endpoint de diagnóstico completo"""
@@ -4115,20 +5239,21 @@ def diagnostics():
     
     diagnostics_data = {
         "status": "operational",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": iso_now(),
         "system": {
             "uptime_seconds": int(now - health_monitor.last_health_check),
             "python_version": sys.version,
-            "pid": os.getpid()
+            "pid": os.getpid(),
+            "memory_mb": round(get_memory_usage_mb(), 1)
         },
         "telegram": {
-            "last_update": datetime.fromtimestamp(LAST_ACTIVITY["telegram"]).isoformat(),
+            "last_update": iso_second(int(LAST_ACTIVITY["telegram"])),
             "inactive_seconds": int(now - LAST_ACTIVITY["telegram"]),
             "webhook_errors": health_monitor.webhook_errors,
             "is_healthy": health_monitor.is_healthy
         },
         "flask": {
-            "last_request": datetime.fromtimestamp(LAST_ACTIVITY["flask"]).isoformat(),
+            "last_request": iso_second(int(LAST_ACTIVITY["flask"])),
             "inactive_seconds": int(now - LAST_ACTIVITY["flask"])
         },
         "downloads": {
@@ -4157,26 +5282,30 @@ def diagnostics():
     
     # Testa webhook do Telegram
     try:
-        future = asyncio.run_coroutine_threadsafe(application.bot.get_me(), APP_LOOP)
-        webhook_info = future.result(timeout=10)
-        diagnostics_data["telegram"]["bot_username"] = webhook_info.username
-        diagnostics_data["telegram"]["bot_id"] = webhook_info.id
+        # Identidade obtida uma única vez por application.initialize() (get_me)
+        diagnostics_data["telegram"].update(bot_username=BOT_USERNAME, bot_id=BOT_ID)
+        start_bot_refresh()
+        diagnostics_data["telegram"]["api"] = BOT_API_STATUS["status"]
+        if BOT_API_STATUS["status"].startswith("error"):
+            diagnostics_data["status"] = "degraded"
     except Exception as e:
         diagnostics_data["telegram"]["error"] = str(e)
         diagnostics_data["status"] = "degraded"
     
     # Testa banco de dados
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM user_downloads")
-            total_users = cursor.fetchone()[0]
-            diagnostics_data["database"]["total_users"] = total_users
+        diagnostics_data["database"]["total_users"] = _cached_diag_check("db", _fetch_total_users)
     except Exception as e:
         diagnostics_data["database"]["error"] = str(e)
         diagnostics_data["status"] = "degraded"
     
-    return diagnostics_data, 200
+    return ojsonify(diagnostics_data)
+
+# Cache curto do /health: probes concorrentes compartilham um único cálculo
+# e o JSON já serializado
+HEALTH_CACHE_TTL = 1.0
+HEALTH_CACHE = {"ts": 0.0, "payload": None}
+HEALTH_CACHE_LOCK = threading.Lock()
 
 @app.route("/health")
 def health():
@@ -4184,6 +5313,19 @@ def health():
     # Registra atividade do Flask
     LAST_ACTIVITY["flask"] = time.time()
 
+    with HEALTH_CACHE_LOCK:
+        if HEALTH_CACHE["payload"] is not None and time.time() - HEALTH_CACHE["ts"] < HEALTH_CACHE_TTL:
+            return Response(HEALTH_CACHE["payload"], status=200, mimetype="application/json")
+        payload = json_dumps(_build_health_checks())
+        HEALTH_CACHE["ts"] = time.time()
+        HEALTH_CACHE["payload"] = payload
+
+    # ✅ Sempre retorna 200 OK, mesmo se monitor indicar problema
+    return Response(payload, status=200, mimetype="application/json")
+
+
+def _build_health_checks() -> dict:
+    """Monta o payload do /health"""
     # Informações básicas
     checks = {
         "status": "ok",  # Sempre OK para evitar restart
@@ -4198,7 +5340,7 @@ def health():
             "shopee": bool(COOKIE_SHOPEE),
             "instagram": bool(COOKIE_IG)
         },
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": iso_now(),
         "uptime_seconds": int(time.time() - health_monitor.last_health_check)
     }
 
@@ -4206,51 +5348,49 @@ def health():
     health_status = health_monitor.check_health()
     checks.update({
         "monitor": health_status,
-        "last_telegram_activity": datetime.fromtimestamp(LAST_ACTIVITY["telegram"]).isoformat(),
-        "last_flask_activity": datetime.fromtimestamp(LAST_ACTIVITY["flask"]).isoformat()
+        "last_telegram_activity": iso_second(int(LAST_ACTIVITY["telegram"])),
+        "last_flask_activity": iso_second(int(LAST_ACTIVITY["flask"]))
     })
 
-    # ✅ Sempre retorna 200 OK, mesmo se monitor indicar problema
-    return checks, 200
-    
-    # Testa banco de dados
+    # Testa banco de dados numa conexão emprestada do pool de leitura (só
+    # informativo: "status" continua "ok" para não provocar restart)
     try:
-        with DB_LOCK:
-            conn = sqlite3.connect(DB_FILE, timeout=5)
+        with db_reader() as conn:
             conn.execute("SELECT 1")
-            conn.close()
     except Exception as e:
         checks["db"] = f"error: {str(e)}"
-        checks["status"] = "unhealthy"
         LOG.error("Health check DB falhou: %s", e)
-    
-    # Testa bot
-    try:
-        future = asyncio.run_coroutine_threadsafe(application.bot.get_me(), APP_LOOP)
-        bot_info = future.result(timeout=10)
-        checks["bot_username"] = bot_info.username
-        checks["bot_id"] = bot_info.id
-    except Exception as e:
-        checks["bot"] = f"error: {str(e)}"
-        checks["status"] = "unhealthy"
-        LOG.error("Health check bot falhou: %s", e)
-    
-    # Define status HTTP
-    if checks["status"] == "unhealthy" or not health_status["healthy"]:
-        status_code = 503  # Service Unavailable
-        checks["status"] = "unhealthy"
-    else:
-        status_code = 200
-    
-    return checks, status_code
+
+    return checks
 
 # ============================
 # MERCADOPAGO
 # ============================
 
-from flask import request
-import mercadopago
-import os
+# Pool para trabalho de webhooks (consultas ao Mercado Pago, alertas do
+# Discord): as rotas respondem na hora e o I/O externo roda aqui
+WEBHOOK_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="webhook")
+
+def _process_pix_notification(payment_id):
+    """Consulta o pagamento notificado e confirma o premium se aprovado"""
+    sdk = MP_SDK
+    if sdk is None:
+        LOG.error("Notificação PIX %s ignorada - Mercado Pago não configurado", payment_id)
+        return
+
+    try:
+        payment = sdk.payment().get(payment_id)["response"]
+
+        if payment["status"] == "approved":
+            # O dono vem do registro local (pix_key = ID do pagamento), não da
+            # external_reference, e a confirmação segue o mesmo caminho do poller
+            user_id = find_pix_payment_user(payment["id"])
+            if user_id is None:
+                LOG.warning("Pagamento aprovado %s sem registro local - ignorando", payment["id"])
+                return
+            run_on_loop(activate_premium(user_id, payment["id"]), timeout=30)
+    except Exception as e:
+        LOG.exception("Erro ao processar notificação PIX %s: %s", payment_id, e)
 
 @app.route("/webhook/pix", methods=["POST"])
 def webhook_pix():
@@ -4261,22 +5401,12 @@ def webhook_pix():
 
         if data.get("type") == "payment":
             payment_id = data["data"]["id"]
-            sdk = mercadopago.SDK(os.getenv("MERCADOPAGO_ACCESS_TOKEN"))
-            payment = sdk.payment().get(payment_id)["response"]
-
-            if payment["status"] == "approved":
-                # Extrai o valor do campo external_reference que deve conter o user_id
-                reference = payment.get("external_reference")
-                if reference and reference.startswith("PIX_"):
-                    parts = reference.split("_")
-                    if len(parts) == 3:
-                        user_id = int(parts[2])
-                        confirm_pix_payment(payment_reference=reference, user_id=user_id)
-                        LOG.info("Pagamento confirmado e premium ativado para user_id=%s", user_id)
-                    else:
-                        LOG.warning("Formato de referência inválido: %s", reference)
-                else:
-                    LOG.warning("Referência externa ausente ou inválida: %s", reference)
+
+            # Pagamento em monitoramento: o poller confirma o status e ativa o premium
+            if notify_payment_webhook(payment_id):
+                return "ok", 200
+
+            WEBHOOK_EXECUTOR.submit(_process_pix_notification, payment_id)
 
         return "ok", 200
 
@@ -4294,6 +5424,53 @@ import os
 
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")  # opcional: URL de webhook do Discord para alertas
 
+# Eventos do Render que geram alerta
+RENDER_RELEVANT_EVENTS = frozenset({
+    "deploy_started",
+    "deploy_ended",
+    "service_unhealthy",
+    "server_unhealthy",
+    "service_started",
+    "server_started"
+})
+# Varredura barata do corpo bruto: sem nenhum desses prefixos o evento é
+# descartado sem decodificar o JSON
+RENDER_EVENT_HINT_RE = re.compile(rb'"(?:deploy|service|server)_', re.IGNORECASE)
+
+# Sessão keep-alive: alertas seguidos (deploy_started → deploy_ended)
+# reaproveitam a conexão TLS com o Discord
+_DISCORD_SESSION = None
+if REQUESTS_AVAILABLE:
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    _DISCORD_SESSION = requests.Session()
+    _DISCORD_SESSION.mount("https://", HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=4,
+        max_retries=Retry(total=1, backoff_factor=0.2)
+    ))
+
+def _send_discord_alert(message: str):
+    """Envia o alerta para o Discord (roda no WEBHOOK_EXECUTOR)"""
+    if _DISCORD_SESSION is None:
+        LOG.warning("⚠️ requests indisponível - alerta do Discord ignorado")
+        return
+    try:
+        # Timeout curto para não prender o worker
+        response = _DISCORD_SESSION.post(
+            DISCORD_WEBHOOK_URL, 
+            json={"content": message},
+            timeout=3  # 3 segundos máximo
+        )
+        if response.status_code == 204:
+            LOG.debug("✅ Alerta enviado para Discord")
+        else:
+            LOG.warning("⚠️ Discord retornou status %d", response.status_code)
+    except requests.Timeout:
+        LOG.warning("⚠️ Timeout ao enviar para Discord")
+    except Exception as e:
+        LOG.error("❌ Erro ao enviar para Discord: %s", e)
+
 @app.route("/render-webhook", methods=["GET", "POST"])
 def render_webhook():
     """
@@ -4306,7 +5483,14 @@ def render_webhook():
             return {"status": "active", "message": "Webhook ativo"}, 200
         
         # POST request - processa evento do Render
-        payload = request.get_json(silent=True) or {}
+        raw = request.get_data(cache=False)
+        if not RENDER_EVENT_HINT_RE.search(raw):
+            return {"message": "Evento ignorado"}, 200
+        
+        try:
+            payload = json_loads(raw) or {}
+        except ValueError:
+            payload = {}
         
         # Retorna OK imediatamente para evitar timeout
         # Processamento será feito em background
@@ -4320,16 +5504,7 @@ def render_webhook():
         status = data.get("status")
 
         # === 🔹 FILTRO DE EVENTOS RELEVANTES ===
-        eventos_relevantes = [
-            "deploy_started",
-            "deploy_ended",
-            "service_unhealthy",
-            "server_unhealthy",
-            "service_started",
-            "server_started"
-        ]
-        
-        if event_type not in eventos_relevantes:
+        if event_type not in RENDER_RELEVANT_EVENTS:
             # Retorna OK sem processar
             return {"message": f"Evento ignorado: {event_type}"}, 200
 
@@ -4386,21 +5561,7 @@ def render_webhook():
             return {"error": "Webhook do Discord não configurado"}, 200  # Retorna 200 para não causar erro
 
         # === 🔹 Envia mensagem pro Discord em background (não bloqueia) ===
-        try:
-            # Timeout curto para não travar o webhook
-            response = requests.post(
-                DISCORD_WEBHOOK_URL, 
-                json={"content": message},
-                timeout=3  # 3 segundos máximo
-            )
-            if response.status_code == 204:
-                LOG.debug("✅ Alerta enviado para Discord")
-            else:
-                LOG.warning("⚠️ Discord retornou status %d", response.status_code)
-        except requests.Timeout:
-            LOG.warning("⚠️ Timeout ao enviar para Discord")
-        except Exception as e:
-            LOG.error("❌ Erro ao enviar para Discord: %s", e)
+        WEBHOOK_EXECUTOR.submit(_send_discord_alert, message)
         
         # Sempre retorna 200 OK para o Render
         return {"status": "received", "event": event_type}, 200
@@ -4427,21 +5588,25 @@ async def subscribe_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.edit_message_text("❌ Sistema de pagamentos não configurado.")
             return
             
-        reference = create_pix_payment(user_id, PREMIUM_PRICE)
-        sdk = mercadopago.SDK(MERCADOPAGO_ACCESS_TOKEN)
+        sdk = MP_SDK
+        if sdk is None:
+            await query.edit_message_text("❌ Sistema de pagamentos não configurado.")
+            return
 
         payment_data = {
             "transaction_amount": PREMIUM_PRICE,
             "description": "Plano Premium",
             "payment_method_id": "pix",
             "payer": {"email": f"user{user_id}@example.com"},
-            "external_reference": reference
+            "external_reference": f"PIX_{user_id}_{int(time.time())}"
         }
 
         result = sdk.payment().create(payment_data)
         response = result.get("response", {})
 
         if response.get("status") == "pending":
+            # Registro local chaveado pelo ID do Mercado Pago (confirmação idempotente)
+            create_pix_payment(user_id, PREMIUM_PRICE, pix_key=str(response["id"]))
             qr_code_text = response["point_of_interaction"]["transaction_data"]["qr_code"]
 
             await query.edit_message_text(
@@ -4471,112 +5636,140 @@ async def _start_long_polling():
     público) — o bot passa a buscar updates ativamente no Telegram em vez
     de esperar POSTs, então não precisa de porta pública exposta.
     """
-    await application.bot.delete_webhook(drop_pending_updates=True)
+    await application.bot.delete_webhook(drop_pending_updates=DROP_PENDING)
     await application.start()
     await application.updater.start_polling(
-        drop_pending_updates=True,
-        allowed_updates=["message", "callback_query"]
+        drop_pending_updates=DROP_PENDING,
+        allowed_updates=ALLOWED_UPDATES
     )
 
+async def _setup_webhook():
+    """Configura o webhook e retorna o WebhookInfo numa única ida ao loop.
+
+    setWebhook substitui o webhook anterior e drop_pending_updates
+    (DROP_PENDING) descarta a fila antiga, dispensando o delete_webhook + espera.
+    """
+    result = await application.bot.set_webhook(drop_pending_updates=DROP_PENDING, **SET_WEBHOOK_ARGS)
+    if not result:
+        return None
+    return await application.bot.get_webhook_info()
+
+def _configure_webhook_when_ready(port: int, deadline: float = 30.0):
+    """Registra o webhook só depois que o servidor HTTP aceita conexões.
+
+    Evita a janela em que o Telegram já envia updates para uma porta ainda
+    fechada (e passa a reenviá-los).
+    """
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    else:
+        LOG.warning("⚠️ Servidor não respondeu em %.0fs - configurando webhook mesmo assim", deadline)
+    
+    try:
+        LOG.info("🔗 Configurando webhook: %s", WEBHOOK_FULL_URL)
+        
+        webhook_info = run_on_loop_retry(_setup_webhook)
+        
+        if webhook_info:
+            LOG.info("✅ Webhook configurado com sucesso!")
+            LOG.info("📊 Webhook Info: URL=%s, Pending=%d", 
+                    webhook_info.url, 
+                    webhook_info.pending_update_count)
+        else:
+            LOG.error("❌ Falha ao configurar webhook")
+        
+    except Exception as e:
+        LOG.error("❌ Erro ao configurar webhook: %s", e)
+
+async def aggressive_gc_routine():
+    """Força garbage collection periodicamente para liberar memória"""
+    while True:
+        try:
+            await asyncio.sleep(300)  # 5 minutos
+            # Geração 1: objetos congelados por gc.freeze() e sobreviventes antigos ficam fora
+            collected = await asyncio.get_running_loop().run_in_executor(GC_EXEC, gc.collect, 1)
+            if collected > 0:
+                LOG.debug("🧹 GC agressivo: %s objetos coletados", collected)
+        except Exception as e:
+            LOG.error("❌ Erro em GC agressivo: %s", e)
+
+async def _schedule_bg():
+    """Cria as rotinas de manutenção como tarefas no APP_LOOP (nenhuma thread própria)"""
+    routines = [cleanup_and_gc_routine(), memory_cleanup_routine(), aggressive_gc_routine()]
+    if PSUTIL_AVAILABLE:
+        routines.append(system_sampler_routine())
+    if KEEPALIVE_ENABLED:
+        routines += [keepalive_routine(), webhook_watchdog()]
+    for coro in routines:
+        task = asyncio.create_task(coro)
+        BACKGROUND_TASKS.add(task)
+        task.add_done_callback(BACKGROUND_TASKS.discard)
+
 if __name__ == "__main__":
-    # Inicia thread de limpeza automática e garbage collection
-    cleanup_thread = threading.Thread(target=cleanup_and_gc_routine, daemon=True)
-    cleanup_thread.start()
-    LOG.info("✅ Thread de limpeza automática e GC iniciada")
-    
-    # 🧹 Garbage collection agressivo a cada 5 minutos
-    def aggressive_gc_routine():
-        """Força garbage collection periodicamente para liberar memória"""
-        while True:
-            try:
-                time.sleep(300)  # 5 minutos
-                collected = gc.collect()
-                if collected > 0:
-                    LOG.debug(f"🧹 GC agressivo: {collected} objetos coletados")
-            except Exception as e:
-                LOG.error(f"❌ Erro em GC agressivo: {e}")
+    # Objetos da inicialização (módulos, handlers, caches) saem das coletas futuras
+    gc.freeze()
     
-    gc_thread = threading.Thread(target=aggressive_gc_routine, daemon=True)
-    gc_thread.start()
-    LOG.info("✅ Thread de GC agressivo iniciada (intervalo: 5min)")
+    # Limpeza, GC, amostragem de memória, keepalive e watchdog: tarefas no
+    # APP_LOOP (sem threads dedicadas)
+    run_on_loop(_schedule_bg())
+    LOG.info("✅ Tarefa de limpeza automática e GC iniciada")
+    LOG.info("✅ Tarefa de GC agressivo iniciada (intervalo: 5min)")
+    if PSUTIL_AVAILABLE:
+        LOG.info("✅ Tarefa de amostragem de sistema iniciada (intervalo: %ds)", SYS_SAMPLE_INTERVAL)
     
     # 🚀 Inicia rotina periódica de limpeza de memória (assíncrona)
-    asyncio.run_coroutine_threadsafe(memory_cleanup_routine(), APP_LOOP)
-    LOG.info(f"✅ Rotina de limpeza de memória iniciada (intervalo: {MEMORY_CLEANUP_INTERVAL}s, limite: {MAX_MEMORY_USAGE_MB}MB)")
+    start_bot_refresh()
+    LOG.info("✅ Rotina de limpeza de memória iniciada (intervalo: %ss, limite: %sMB)", MEMORY_CLEANUP_INTERVAL, MAX_MEMORY_USAGE_MB)
     
     # 🔄 Inicia sistema de auto-recuperação e keepalive
     if KEEPALIVE_ENABLED:
-        keepalive_thread = threading.Thread(target=keepalive_routine, daemon=True)
-        keepalive_thread.start()
-        LOG.info("✅ Thread de keepalive iniciada (intervalo: %d segundos)", KEEPALIVE_INTERVAL)
-        
-        watchdog_thread = threading.Thread(target=webhook_watchdog, daemon=True)
-        watchdog_thread.start()
-        LOG.info("✅ Thread de watchdog iniciada")
+        LOG.info("✅ Tarefa de keepalive iniciada (intervalo: %d segundos)", KEEPALIVE_INTERVAL)
+        LOG.info("✅ Tarefa de watchdog iniciada")
     else:
         LOG.warning("⚠️ Sistema de keepalive desabilitado")
     
-    # Configura webhook se URL estiver definida
+    # Configura webhook se URL estiver definida (assim que o servidor subir)
     if WEBHOOK_URL:
+        # Fetcher que consome application.update_queue: iniciado antes do
+        # servidor e independente do set_webhook (falha/retentativa dele não
+        # deixa updates parados na fila)
         try:
-            webhook_url = f"{WEBHOOK_URL}/{TOKEN}"
-            LOG.info("🔗 Configurando webhook: %s", webhook_url)
-            
-            # CORREÇÃO: Remove webhook antigo PRIMEIRO para evitar erros 502
-            LOG.info("🗑️ Removendo webhook antigo...")
-            delete_future = asyncio.run_coroutine_threadsafe(
-                application.bot.delete_webhook(drop_pending_updates=True),
-                APP_LOOP
-            )
-            delete_future.result(timeout=10)
-            LOG.info("✅ Webhook antigo removido")
-            
-            # Aguarda um pouco para Telegram processar
-            time.sleep(2)
-            
-            # Agora configura o novo webhook
-            LOG.info("🔗 Configurando novo webhook...")
-            set_future = asyncio.run_coroutine_threadsafe(
-                application.bot.set_webhook(
-                    url=webhook_url,
-                    drop_pending_updates=False,
-                    max_connections=100,
-                    allowed_updates=["message", "callback_query"]
-                ),
-                APP_LOOP
-            )
-            result = set_future.result(timeout=10)
-            
-            if result:
-                LOG.info("✅ Webhook configurado com sucesso!")
-                
-                # Verifica webhook
-                info_future = asyncio.run_coroutine_threadsafe(
-                    application.bot.get_webhook_info(),
-                    APP_LOOP
-                )
-                webhook_info = info_future.result(timeout=10)
-                LOG.info("📊 Webhook Info: URL=%s, Pending=%d", 
-                        webhook_info.url, 
-                        webhook_info.pending_update_count)
-            else:
-                LOG.error("❌ Falha ao configurar webhook")
-            
+            run_on_loop(application.start(), timeout=30)
+            LOG.info("✅ Application iniciada (consumindo update_queue)")
         except Exception as e:
-            LOG.error("❌ Erro ao configurar webhook: %s", e)
+            LOG.exception("❌ Erro ao iniciar Application: %s", e)
+        threading.Thread(target=_configure_webhook_when_ready, args=(PORT,), daemon=True).start()
     else:
         LOG.info("🔄 WEBHOOK_URL não definida - iniciando em modo long-polling")
         try:
-            polling_future = asyncio.run_coroutine_threadsafe(_start_long_polling(), APP_LOOP)
-            polling_future.result(timeout=30)
+            run_on_loop(_start_long_polling(), timeout=30)
             LOG.info("✅ Long-polling iniciado com sucesso!")
         except Exception as e:
             LOG.exception("❌ Erro ao iniciar long-polling: %s", e)
 
     if __name__ == "__main__":
-        port = int(os.environ.get("PORT", 10000))
-        LOG.info("🚀 Iniciando servidor Flask na porta %d", port)
-        app.run(host="0.0.0.0", port=port)
+        if ASGI_AVAILABLE:
+            # Conexões e parsing HTTP no event loop do uvicorn (uvloop/httptools
+            # quando instalados); as views do Flask rodam em paralelo nas
+            # WSGI_THREADS threads do a2wsgi
+            LOG.info("🚀 Iniciando servidor ASGI (uvicorn) na porta %d (%d threads WSGI)", PORT, WSGI_THREADS)
+            uvicorn.run(
+                WSGIMiddleware(app, workers=WSGI_THREADS),
+                host=BIND_HOST,
+                port=PORT,
+                loop="auto",
+                http="auto",
+                workers=1,
+                log_level="warning"
+            )
+        else:
+            LOG.info("🚀 Iniciando servidor Flask na porta %d", PORT)
+            app.run(host=BIND_HOST, port=PORT)
 
 # ============================
 # OTIMIZAÇÕES ADICIONAIS (SAFE)
@@ -4638,7 +5831,7 @@ async def safe_stream_download(url, headers=None, cookies=None, timeout=120, out
                                 async for chunk in r.aiter_bytes(chunk_size=CHUNK_SIZE):
                                     if chunk:
                                         f.write(chunk)
-                            LOG.debug(f"📥 Download (streaming): {url[:80]}... → {output_file}")
+                            LOG.debug("📥 Download (streaming): %s... → %s", url[:80], output_file)
                             return output_file
                         else:
                             # Retornar generator de chunks
@@ -4649,7 +5842,7 @@ async def safe_stream_download(url, headers=None, cookies=None, timeout=120, out
                             return chunk_generator()
                             
             except Exception as e:
-                LOG.warning(f"httpx streaming falhou: {e}. Usando requests...")
+                LOG.warning("httpx streaming falhou: %s. Usando requests...", e)
         
         # Fallback para requests (síncrono mas com streaming)
         resp = requests.get(
@@ -4667,7 +5860,7 @@ async def safe_stream_download(url, headers=None, cookies=None, timeout=120, out
                 for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
                     if chunk:
                         f.write(chunk)
-            LOG.debug(f"📥 Download (streaming via requests): {url[:80]}... → {output_file}")
+            LOG.debug("📥 Download (streaming via requests): %s... → %s", url[:80], output_file)
             return output_file
         else:
             # Retornar generator de chunks
@@ -4678,10 +5871,10 @@ async def safe_stream_download(url, headers=None, cookies=None, timeout=120, out
             return chunk_generator()
     
     except requests.Timeout:
-        LOG.error(f"⏱️ Timeout ao fazer download streaming: {url}")
+        LOG.error("⏱️ Timeout ao fazer download streaming: %s", url)
         raise
     except Exception as e:
-        LOG.error(f"❌ Erro no streaming: {e}")
+        LOG.error("❌ Erro no streaming: %s", e)
         raise
 
 